@@ -1,7 +1,7 @@
 from pathlib import Path
 from typing import Dict
 
-from .julius import palign
+from .julius import palign, palign_chunked
 from autoannot.docs import fill_doc
 
 
@@ -28,6 +28,11 @@ def align(in_file: str | Path, out_file: str | Path, trs_file: str | Path, param
     """
 
     if params["alignment"]["backend"] == "julius":
-        palign(in_file, out_file, trs_file)
+
+        # IPUs aligned separately across processes
+        if params["alignment"].get("chunked", False):
+            palign_chunked(in_file, out_file, trs_file, n_jobs=params["alignment"].get("n_jobs"))
+        else:
+            palign(in_file, out_file, trs_file)
     else:
         raise NotImplementedError(f"Backend '{params['align']['backend']}' is not supported")
\ No newline at end of file
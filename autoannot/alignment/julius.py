@@ -1,11 +1,29 @@
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import json
+import logging
+import multiprocessing
+import multiprocessing.util
 import os
 from pathlib import Path
 import re
 import sys
 import tempfile
+import threading
+import traceback
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.io import wavfile
 
 from autoannot.constants import ROOT_DIR
 from autoannot.docs import fill_doc
+from autoannot.utils.annotations import merge_rows
+from autoannot.utils.audio import get_file_hash, get_segment, open_audio
+from autoannot.utils.files import lock_file
+from autoannot.utils.models import evict_model, get_model
 
 # Add SPPAS path
 sys.path.append(str(ROOT_DIR / "libs" / "SPPAS"))
@@ -13,6 +31,8 @@ sys.path.append(str(ROOT_DIR / "libs" / "SPPAS"))
 from sppas.src.annotations import sppasTextNorm  # noqa
 from sppas.src.annotations import sppasPhon      # noqa
 from sppas.src.annotations import sppasAlign     # noqa
+from sppas.src.anndata import sppasTrsRW, sppasTranscription, sppasTier  # noqa
+from sppas.src.anndata import sppasLocation, sppasInterval, sppasPoint, sppasLabel, sppasTag  # noqa
 
 # Resource paths
 RESOURCE_PATH = ROOT_DIR / "libs" / "SPPAS" / "resources"
@@ -21,48 +41,287 @@ DICT_PATH = RESOURCE_PATH / "dict" / "fra.dict"
 MODEL_PATH = RESOURCE_PATH / "models" / "models-fra"
 LANG = "fra"
 
+# Sample rate of the acoustic model
+ALIGN_SAMPLE_RATE = 16_000
+
+# Aligner of each worker of the process pool (chunked alignment)
+_WORKER_ALIGNER = None
+
+# Process pool of the chunked alignment and its number of workers, kept for the next files
+_POOL: None | Tuple[ProcessPoolExecutor, int] = None
+_POOL_LOCK = threading.Lock()
+
+# Pronunciations already found by SPPAS (shared by files and runs), None to phonetize every time
+_PHON_CACHE_FILE: None | Path = None
+
+logger = logging.getLogger(__name__)
+
+
+class JuliusAligner:
+    """
+    SPPAS + Julius forced alignment with the resources (vocabulary, dictionary and acoustic model) loaded once, to
+    align a stream of files
+
+    Parameters
+    ----------
+    vocab_path : str | Path
+        Vocabulary of the text normalization
+    dict_path : str | Path
+        Pronunciation dictionary of the phonetization
+    model_path : str | Path
+        Acoustic model of the alignment
+    lang : str
+        Language of the vocabulary
+    phon_cache : None | str | Path
+        JSON file of the pronunciation variants of the words already phonetized (discarded if ``dict_path`` changes),
+        if ``None`` every word is phonetized by SPPAS. New words are kept in memory until ``save_phon_cache`` (called
+        by ``align_files`` and ``close``)
+    """
+
+    def __init__(self, vocab_path: str | Path = VOCAB_PATH, dict_path: str | Path = DICT_PATH,
+                 model_path: str | Path = MODEL_PATH, lang: str = LANG, phon_cache: None | str | Path = None):
+
+        self.text_norm = sppasTextNorm(log=None)
+        self.text_norm.load_resources(str(vocab_path), lang=lang)
+
+        self.phon = sppasPhon(log=None)
+        self.phon.load_resources(str(dict_path))
+
+        # Word -> variants of each of its phonetizations
+        self.phon_cache_file = None if phon_cache is None else Path(phon_cache)
+        self.dict_checksum = None if phon_cache is None else get_file_hash(dict_path)
+        self.phon_cache = None if phon_cache is None else _load_phon_cache(self.phon_cache_file, self.dict_checksum)
+        self._n_new_words = 0
+
+        self.aligner = sppasAlign(log=None)
+        self.aligner.load_resources(str(model_path))
+
+        # Intermediate files of all alignments (removed once each file is aligned)
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp.name)
+
+    @fill_doc
+    def align(self, wav_file: str | Path, out_file: str | Path, trs_file: str | Path) -> None:
+        """
+        Align a transcription file with its WAV file
+
+        Parameters
+        ----------
+        %(wav_file)s
+        %(out_file)s
+        %(trs_file)s
+
+        Returns
+        -------
+        None
+        """
+
+        fname = os.path.basename(trs_file)
+        match = re.match(r"(.*)(\.csv|TextGrid)", fname)
+        if match:
+            file_stem = match.group(1)
+        else:
+            raise ValueError(f"File type must be '.csv' or '.TextGrid' but got {fname}")
+
+        token_file = self.tmp_dir / f"{file_stem}-token.TextGrid"
+        phon_file = self.tmp_dir / f"{file_stem}-phon.TextGrid"
+
+        try:
+            # Normalize the transcription ##############################################################################
+            _sppas_normalize(self.text_norm, in_file=str(trs_file), out_file=str(token_file))
+
+            # Phonetize the transcription ##############################################################################
+            if self.phon_cache is None:
+                _sppas_phonetize(self.phon, in_file=str(token_file), out_file=str(phon_file))
+
+            else:
+                self._n_new_words += _cached_phonetize(self.phon, self.phon_cache, in_file=token_file, out_file=phon_file)
+
+            # Align with WAV file ######################################################################################
+            self.aligner.run([str(phon_file), str(wav_file), str(token_file)], str(out_file))
+
+        finally:
+            for path in (token_file, phon_file):
+                if path.exists():
+                    os.remove(path)
+
+    def align_files(self, wav_files: List[str | Path], out_files: List[str | Path],
+                    trs_files: List[str | Path]) -> None:
+        """
+        Align each transcription file with its WAV file, then save the new words to the pronunciation cache
+
+        Parameters
+        ----------
+        wav_files : List[str | Path]
+            Paths to the WAV files
+        out_files : List[str | Path]
+            Paths to the output files
+        trs_files : List[str | Path]
+            Paths to the transcription files
+
+        Returns
+        -------
+        None
+        """
+
+        try:
+            for wav_file, out_file, trs_file in zip(wav_files, out_files, trs_files):
+                self.align(wav_file, out_file, trs_file)
+
+        finally:
+            self.save_phon_cache()
+
+    def save_phon_cache(self) -> None:
+        """
+        Save the words phonetized by SPPAS since the last save to the pronunciation cache, if any
+
+        Returns
+        -------
+        None
+        """
+
+        if self.phon_cache is not None and self._n_new_words > 0:
+            _save_phon_cache(self.phon_cache_file, self.dict_checksum, self.phon_cache)
+            self._n_new_words = 0
+
+    def close(self) -> None:
+        """
+        Save the pronunciation cache and remove the directory of the intermediate files
+
+        Returns
+        -------
+        None
+        """
+
+        self.save_phon_cache()
+        self._tmp.cleanup()
+
 
 @fill_doc
 def palign(wav_file: str | Path, out_file: str | Path, trs_file: str | Path) -> None:
     """
     Perform SPPAS + Julius forced alignment on the transcription file and the WAV file
 
+    The aligner is loaded once per process and reused by every call, its new words are saved to the pronunciation
+    cache at exit
+
+    Parameters
+    ----------
+    %(wav_file)s
+    %(out_file)s
+    %(trs_file)s
+
+    Returns
+    -------
+    None
+    """
+
+    aligner = _get_aligner()
+    aligner.align(wav_file, out_file, trs_file)
+
+
+def set_phon_cache(cache_file: None | str | Path) -> None:
+    """
+    Set the file where the pronunciations found by SPPAS are kept for the next files and runs
+
+    Parameters
+    ----------
+    cache_file : None | str | Path
+        JSON file (created if needed), if ``None`` every word is phonetized by SPPAS
+
+    Returns
+    -------
+    None
+    """
+
+    global _PHON_CACHE_FILE
+
+    # Words found with the previous cache are saved before its aligners are dropped
+    _save_aligner_phon_cache()
+
+    _PHON_CACHE_FILE = None if cache_file is None else Path(cache_file)
+
+    if _PHON_CACHE_FILE is not None:
+        os.makedirs(_PHON_CACHE_FILE.parent, exist_ok=True)
+
+    # The aligners are loaded again with this cache
+    evict_model("julius", str(MODEL_PATH), "cpu")
+    _shutdown_pool()
+
+
+@fill_doc
+def palign_chunked(wav_file: str | Path, out_file: str | Path, trs_file: str | Path,
+                   n_jobs: None | int = None) -> None:
+    """
+    Perform SPPAS + Julius forced alignment IPU by IPU, across a process pool
+
+    Each IPU of the transcription is aligned with its own segment of the audio by a worker holding its own aligner,
+    then the tiers of all IPUs are stitched back with absolute times (silences between IPUs are ``#``). The pool and
+    the aligners of its workers are kept for the next files
+
+    IPUs that could not be aligned are left without labels in the output file, then an error listing them is raised
+
     Parameters
     ----------
     %(wav_file)s
     %(out_file)s
     %(trs_file)s
+    n_jobs : None | int
+        Maximum number of processes, if ``None`` the number of CPUs. With ``1``, IPUs are aligned in this process by
+        the same aligner as ``palign``
 
     Returns
     -------
     None
+
+    Raises
+    ------
+    RuntimeError
+        If some IPUs could not be aligned, with the error of each of them
     """
 
-    tmp = tempfile.TemporaryDirectory()
-    tmp_dir = Path(tmp.name)
+    with tempfile.TemporaryDirectory() as tmp_dir:
 
-    fname = os.path.basename(trs_file)
-    match = re.match(r"(.*)(\.csv|TextGrid)", fname)
-    if match:
-        file_stem = match.group(1)
-    else:
-        raise ValueError(f"File type must be '.csv' or '.TextGrid' but got {fname}")
+        chunks, duration = _make_chunks(wav_file, trs_file, Path(tmp_dir))
 
-    # Normalize the transcription ######################################################################################
-    token_file = f"{file_stem}-token.TextGrid"
-    _sppas_normalize(in_file=str(trs_file), out_file=str(tmp_dir / token_file))
+        # Error of each IPU that could not be aligned
+        failures = {}
 
-    # Phonetize the transcription ######################################################################################
-    phon_file = f"{file_stem}-phon.TextGrid"
-    _sppas_phonetize(in_file=str(tmp_dir / token_file), out_file=str(tmp_dir / phon_file))
+        if n_jobs == 1:
+            aligner = _get_aligner()
+            for i, (_, _, chunk_wav, chunk_trs, chunk_out) in enumerate(chunks):
+                try:
+                    aligner.align(chunk_wav, chunk_out, chunk_trs)
+                except Exception:  # noqa
+                    failures[i] = traceback.format_exc()
 
-    # Align with WAV file ##############################################################################################
-    annotator = sppasAlign(log=None)
-    annotator.load_resources(str(MODEL_PATH))
+        elif chunks:
+            executor = _get_pool(n_jobs, len(chunks))
+            futures = [executor.submit(_align_chunk, chunk_wav, chunk_out, chunk_trs)
+                       for _, _, chunk_wav, chunk_trs, chunk_out in chunks]
 
-    annotator.run([str(tmp_dir / phon_file), str(wav_file), str(tmp_dir / token_file)], str(out_file))
+            for i, future in enumerate(futures):
+                try:
+                    future.result()
+                except Exception:  # noqa
+                    failures[i] = traceback.format_exc()
 
-    tmp.cleanup()
+            # A worker died, the pool is created again for the next files
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in futures):
+                _shutdown_pool()
+
+        for i, chunk in enumerate(chunks):
+            if i not in failures and not chunk[4].exists():
+                failures[i] = "No alignment written by SPPAS"
+
+        trs = _merge_chunks(chunks, failures, duration)
+
+    sppasTrsRW(str(out_file)).write(trs)
+
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(chunks)} IPUs could not be aligned in {wav_file}:\n" +
+                           "\n".join(f"IPU {chunks[i][0]:.3f}-{chunks[i][1]:.3f} s: {error}"
+                                      for i, error in failures.items()))
 
 ########################################################################################################################
 # Private methods                                                                                                      #
@@ -70,12 +329,14 @@ def palign(wav_file: str | Path, out_file: str | Path, trs_file: str | Path) ->
 
 
 @fill_doc
-def _sppas_normalize(in_file: str | Path, out_file: str | Path) -> None:
+def _sppas_normalize(text_norm: sppasTextNorm, in_file: str | Path, out_file: str | Path) -> None:
     """
     Text normalization with SPPAS on the transcription file
 
     Parameters
     ----------
+    text_norm : sppasTextNorm
+        Text normalization with its vocabulary loaded
     %(in_file)s
     %(out_file)s
 
@@ -84,18 +345,18 @@ def _sppas_normalize(in_file: str | Path, out_file: str | Path) -> None:
     None
     """
 
-    text_norm = sppasTextNorm(log=None)
-    text_norm.load_resources(str(VOCAB_PATH), lang=LANG)
     text_norm.run([in_file], output=out_file)
 
 
 @fill_doc
-def _sppas_phonetize(in_file: str | Path, out_file: str | Path) -> None:
+def _sppas_phonetize(phon: sppasPhon, in_file: str | Path, out_file: str | Path) -> None:
     """
     Phonetization with SPPAS on the transcription file
 
     Parameters
     ----------
+    phon : sppasPhon
+        Phonetization with its dictionary loaded
     %(in_file)s
     %(out_file)s
 
@@ -104,6 +365,424 @@ def _sppas_phonetize(in_file: str | Path, out_file: str | Path) -> None:
     None
     """
 
-    phon = sppasPhon(log=None)
-    phon.load_resources(str(DICT_PATH))
     phon.run([in_file], output=out_file)
+
+
+def _get_aligner() -> JuliusAligner:
+    """
+    Get the aligner of this process, loaded once with the pronunciation cache
+
+    Returns
+    -------
+    aligner : JuliusAligner
+        Aligner kept in the model registry
+    """
+
+    return get_model("julius", str(MODEL_PATH), "cpu", loader=lambda: JuliusAligner(phon_cache=_PHON_CACHE_FILE))
+
+
+@atexit.register
+def _save_aligner_phon_cache() -> None:
+    """
+    Save the new words of the aligner of this process (if loaded) to the pronunciation cache
+
+    Returns
+    -------
+    None
+    """
+
+    aligner = get_model("julius", str(MODEL_PATH), "cpu", loader=lambda: None)
+    if aligner is not None:
+        aligner.save_phon_cache()
+
+
+@fill_doc
+def _make_chunks(wav_file: str | Path, trs_file: str | Path,
+                 tmp_dir: Path) -> Tuple[List[Tuple[float, float, Path, Path, Path]], float]:
+    """
+    Write the audio and the transcription of each IPU, starting at zero
+
+    Parameters
+    ----------
+    %(wav_file)s
+    %(trs_file)s
+    tmp_dir : Path
+        Directory of the chunks
+
+    Returns
+    -------
+    chunks : List[Tuple[float, float, Path, Path, Path]]
+        Start and end of each IPU in the recording, with the paths to its audio, its transcription and its alignment
+    duration : float
+        Duration of the recording in seconds
+    """
+
+    data, sample_rate = open_audio(wav_file, ALIGN_SAMPLE_RATE)
+
+    # Tier of the transcription (silences are "#")
+    tier = sppasTrsRW(str(trs_file)).read().get_tier_list()[0]
+
+    chunks = []
+    for i, annotation in enumerate(tier):
+
+        if annotation.serialize_labels(separator=" ") in ("", "#"):
+            continue
+
+        start = annotation.get_lowest_localization().get_midpoint()
+        end = annotation.get_highest_localization().get_midpoint()
+
+        # Audio of the IPU, as expected by the acoustic model
+        segment = get_segment(data, sample_rate, start, end, ALIGN_SAMPLE_RATE)
+        chunk_wav = tmp_dir / f"chunk_{i}.wav"
+        wavfile.write(chunk_wav, ALIGN_SAMPLE_RATE, (np.clip(segment, -1, 1) * (2 ** 15 - 1)).astype(np.int16))
+
+        # Transcription of the IPU
+        chunk_trs = sppasTranscription(tier.get_name())
+        chunk_tier = chunk_trs.create_tier(tier.get_name())
+        chunk_tier.create_annotation(sppasLocation(sppasInterval(sppasPoint(0.0), sppasPoint(end - start))),
+                                     [label.copy() for label in annotation.get_labels()])
+        sppasTrsRW(str(tmp_dir / f"chunk_{i}.TextGrid")).write(chunk_trs)
+
+        chunks.append((start, end, chunk_wav, tmp_dir / f"chunk_{i}.TextGrid", tmp_dir / f"chunk_{i}-palign.TextGrid"))
+
+    return chunks, len(data) / sample_rate
+
+
+def _merge_chunks(chunks: List[Tuple[float, float, Path, Path, Path]], failures: Dict[int, str],
+                  duration: float) -> sppasTranscription:
+    """
+    Stitch the alignments of the IPUs with absolute times
+
+    Silences at the edges of the IPUs and between them are merged, as in the alignment of the whole recording. IPUs that
+    could not be aligned are kept without labels
+
+    Parameters
+    ----------
+    chunks : List[Tuple[float, float, Path, Path, Path]]
+        Start and end of each IPU in the recording, with the paths to its audio, its transcription and its alignment
+    failures : Dict[int, str]
+        Error of each IPU that could not be aligned, by index in ``chunks``
+    duration : float
+        Duration of the recording in seconds
+
+    Returns
+    -------
+    trs : sppasTranscription
+        Alignment of the recording
+    """
+
+    # Tiers of the alignment of each IPU that did not fail
+    outputs = {i: {tier.get_name(): tier for tier in sppasTrsRW(str(chunk[4])).read().get_tier_list()}
+               for i, chunk in enumerate(chunks) if i not in failures}
+
+    # Annotations of each tier with absolute times (start, end, labels), labels are None for silences
+    tiers = {name: [] for chunk_tiers in outputs.values() for name in chunk_tiers}
+
+    for i, (offset, ipu_end, _, _, _) in enumerate(chunks):
+        for name, annotations in tiers.items():
+
+            # Whole IPU without labels if it could not be aligned
+            if i in failures:
+                chunk_annotations = [(sppasPoint(0.0), sppasPoint(ipu_end - offset), [])]
+            else:
+                chunk_annotations = [(annotation.get_lowest_localization(), annotation.get_highest_localization(),
+                                      None if annotation.serialize_labels(separator=" ") == "#" else
+                                      [label.copy() for label in annotation.get_labels()])
+                                     for annotation in outputs[i].get(name, [])]
+
+            for start, end, labels in chunk_annotations:
+
+                # Silence since the previous IPU
+                tier_end = annotations[-1][1].get_midpoint() if annotations else 0.0
+                annotations.append((sppasPoint(tier_end), sppasPoint(offset + start.get_midpoint()), None))
+
+                annotations.append((sppasPoint(offset + start.get_midpoint(), start.get_radius()),
+                                    sppasPoint(offset + end.get_midpoint(), end.get_radius()), labels))
+
+    trs = sppasTranscription("palign")
+    for name, annotations in tiers.items():
+
+        # Silence after the last IPU
+        annotations.append((sppasPoint(annotations[-1][1].get_midpoint()), sppasPoint(duration), None))
+
+        df = pd.DataFrame({"tier": name,
+                           "start": [start.get_midpoint() for start, _, _ in annotations],
+                           "end": [end.get_midpoint() for _, end, _ in annotations],
+                           "annotation": ["#" if labels is None else "" for _, _, labels in annotations]})
+        df = merge_rows(df[(df["annotation"] != "#") | (df["start"] < df["end"])], target="#")
+
+        # Other annotations are kept as they are, in the same order
+        others = iter(annotation for annotation in annotations if annotation[2] is not None)
+
+        tier = trs.create_tier(name)
+        for row in df.itertuples():
+
+            if row.annotation == "#":
+                _add_silence(tier, row.start, row.end)
+            else:
+                start, end, labels = next(others)
+                tier.create_annotation(sppasLocation(sppasInterval(start, end)), labels)
+
+    return trs
+
+
+def _add_silence(tier: sppasTier, start: float, end: float) -> None:
+    """
+    Add a silence (``#``) to the tier if the interval is not empty
+
+    Parameters
+    ----------
+    tier : sppasTier
+        Tier to add the silence to
+    start : float
+        Start of the silence in seconds
+    end : float
+        End of the silence in seconds
+
+    Returns
+    -------
+    None
+    """
+
+    if end > start:
+        tier.create_annotation(sppasLocation(sppasInterval(sppasPoint(start), sppasPoint(end))),
+                               [sppasLabel(sppasTag("#"))])
+
+
+def _get_pool(n_jobs: None | int, n_chunks: int) -> ProcessPoolExecutor:
+    """
+    Get the process pool of the chunked alignment, created once with no more workers than chunks
+
+    The pool is only created again (with ``n_jobs`` workers) if a file has more chunks than it has workers
+
+    Parameters
+    ----------
+    n_jobs : None | int
+        Maximum number of processes, if ``None`` the number of CPUs
+    n_chunks : int
+        Number of chunks to align
+
+    Returns
+    -------
+    executor : ProcessPoolExecutor
+        Pool whose workers hold their own aligner
+    """
+
+    global _POOL
+
+    max_workers = n_jobs or os.cpu_count() or 1
+    n_workers = min(max_workers, n_chunks)
+
+    with _POOL_LOCK:
+
+        if _POOL is not None and n_workers <= _POOL[1] <= max_workers:
+            return _POOL[0]
+
+        # Grow to the maximum at once so resources are loaded again at most once more
+        if _POOL is not None:
+            _POOL[0].shutdown()
+            n_workers = max_workers
+
+        # Workers are spawned, forking a process that already runs threads (torch, CUDA) can deadlock
+        executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_init_worker, initargs=(_PHON_CACHE_FILE,))
+        _POOL = (executor, n_workers)
+
+        return executor
+
+
+@atexit.register
+def _shutdown_pool() -> None:
+    """
+    Shut down the process pool of the chunked alignment (at exit or when the pronunciation cache changes)
+
+    Returns
+    -------
+    None
+    """
+
+    global _POOL
+
+    with _POOL_LOCK:
+
+        if _POOL is not None:
+            _POOL[0].shutdown()
+            _POOL = None
+
+
+def _init_worker(phon_cache: None | Path) -> None:
+    """
+    Load the aligner of a worker of the process pool, its new words are saved when the worker exits
+
+    Parameters
+    ----------
+    phon_cache : None | Path
+        JSON file of the pronunciations already found by SPPAS
+
+    Returns
+    -------
+    None
+    """
+
+    global _WORKER_ALIGNER
+    _WORKER_ALIGNER = JuliusAligner(phon_cache=phon_cache)
+
+    # Run by multiprocessing at the exit of the worker (atexit is not)
+    multiprocessing.util.Finalize(None, _WORKER_ALIGNER.save_phon_cache, exitpriority=0)
+
+
+@fill_doc
+def _align_chunk(wav_file: str | Path, out_file: str | Path, trs_file: str | Path) -> None:
+    """
+    Align an IPU with the aligner of the worker
+
+    Parameters
+    ----------
+    %(wav_file)s
+    %(out_file)s
+    %(trs_file)s
+
+    Returns
+    -------
+    None
+    """
+
+    _WORKER_ALIGNER.align(wav_file, out_file, trs_file)
+
+
+def _cached_phonetize(phon: sppasPhon, phon_cache: Dict[str, List[List[str]]], in_file: Path, out_file: Path) -> int:
+    """
+    Phonetization of the transcription file, with SPPAS only for the words that are not in the cache
+
+    The missing words are phonetized in a single SPPAS run (one annotation per word) and added to the cache. If SPPAS
+    does not phonetize some of them, the whole file is phonetized by SPPAS.
+
+    Parameters
+    ----------
+    phon : sppasPhon
+        Phonetization with its dictionary loaded
+    phon_cache : Dict[str, List[List[str]]]
+        Variants of each phonetization of each word, updated with the missing words
+    in_file : Path
+        Path to the normalized transcription
+    out_file : Path
+        Path to the phonetized transcription
+
+    Returns
+    -------
+    n_words : int
+        Number of words added to the cache
+    """
+
+    token_trs = sppasTrsRW(str(in_file)).read()
+    token_tier = token_trs.find("Tokens", case_sensitive=False) or token_trs.get_tier_list()[0]
+
+    tokens = [[label.get_best().get_content() for label in annotation.get_labels()] for annotation in token_tier]
+    missing = sorted({word for words in tokens for word in words} - phon_cache.keys())
+
+    if missing:
+
+        # One annotation per missing word
+        word_trs = sppasTranscription("words")
+        word_tier = word_trs.create_tier(token_tier.get_name())
+        for i, word in enumerate(missing):
+            word_tier.create_annotation(sppasLocation(sppasInterval(sppasPoint(i), sppasPoint(i + 1))),
+                                        [sppasLabel(sppasTag(word))])
+
+        word_file = out_file.parent / f"{out_file.stem}-words.TextGrid"
+        word_phon_file = out_file.parent / f"{out_file.stem}-words-phon.TextGrid"
+        sppasTrsRW(str(word_file)).write(word_trs)
+
+        try:
+            _sppas_phonetize(phon, in_file=str(word_file), out_file=str(word_phon_file))
+
+            for annotation in sppasTrsRW(str(word_phon_file)).read().get_tier_list()[0]:
+                word = missing[round(annotation.get_lowest_localization().get_midpoint())]
+                phon_cache[word] = [[tag.get_content() for tag, _ in label] for label in annotation.get_labels()]
+
+        finally:
+            for path in (word_file, word_phon_file):
+                if path.exists():
+                    os.remove(path)
+
+    n_words = len(missing) - len(set(missing) - phon_cache.keys())
+
+    # Fall back on SPPAS for the whole file
+    if any(word not in phon_cache for words in tokens for word in words):
+        _sppas_phonetize(phon, in_file=str(in_file), out_file=str(out_file))
+        return n_words
+
+    # Same tier as SPPAS: one label per word, with one tag per variant
+    phon_trs = sppasTranscription("phonetization")
+    phon_tier = phon_trs.create_tier("Phones")
+    for annotation, words in zip(token_tier, tokens):
+        phon_tier.create_annotation(annotation.get_location().copy(),
+                                    [sppasLabel([sppasTag(variant) for variant in variants])
+                                     for word in words for variants in phon_cache[word]])
+
+    sppasTrsRW(str(out_file)).write(phon_trs)
+
+    return n_words
+
+
+def _load_phon_cache(cache_file: Path, dict_checksum: str) -> Dict[str, List[List[str]]]:
+    """
+    Load the pronunciations already found by SPPAS
+
+    Parameters
+    ----------
+    cache_file : Path
+        JSON file of the cache
+    dict_checksum : str
+        Hash of the pronunciation dictionary, the cache is discarded if it was filled with another dictionary
+
+    Returns
+    -------
+    phon_cache : Dict[str, List[List[str]]]
+        Variants of each phonetization of each word
+    """
+
+    try:
+        with open(cache_file, "r") as f:
+            content = json.load(f)
+
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+    if content.get("dict_checksum") != dict_checksum:
+        logger.info(f"Pronunciation dictionary changed, {cache_file} discarded")
+        return {}
+
+    return content["words"]
+
+
+def _save_phon_cache(cache_file: Path, dict_checksum: str, phon_cache: Dict[str, List[List[str]]]) -> None:
+    """
+    Save the pronunciations found by SPPAS, with the ones saved by other processes in the meantime
+
+    The file is locked while it is read and replaced, so workers of other processes never drop each other's words
+
+    Parameters
+    ----------
+    cache_file : Path
+        JSON file of the cache
+    dict_checksum : str
+        Hash of the pronunciation dictionary
+    phon_cache : Dict[str, List[List[str]]]
+        Variants of each phonetization of each word, updated with the saved ones
+
+    Returns
+    -------
+    None
+    """
+
+    with lock_file(cache_file):
+
+        phon_cache.update({word: variants for word, variants in _load_phon_cache(cache_file, dict_checksum).items()
+                           if word not in phon_cache})
+
+        # Replace the file at once so readers (not locking it) never see it half written
+        temp_file = cache_file.parent / f"{cache_file.name}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"dict_checksum": dict_checksum, "words": phon_cache}, f, ensure_ascii=False)
+        os.replace(temp_file, cache_file)
@@ -1,4 +1,5 @@
 # Default parameters for SPPAS in seconds
+WIN_LENGTH = 0.02
 MIN_SIL = 0.05
 MIN_IPU = 0.1
 SHIFT_START = 0.01
@@ -6,5 +7,9 @@ SHIFT_END = 0.01
 MIN_MEAN_DURATION = 60
 MIN_N_IPUS = 10
 
+# Factors of the estimated RMS threshold evaluated by the threshold search
+THRESHOLD_GRID = (0.25, 0.35, 0.5, 0.7, 1.0, 1.4, 2.0, 2.8, 4.0, 5.6, 8.0)
+
 # Pyannote details
 PYANNOT_MODEL = "pyannote/speaker-diarization-3.0"
+PYANNOT_SAMPLE_RATE = 16_000
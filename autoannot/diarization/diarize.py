@@ -1,22 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from pathlib import Path
-import tempfile
-from typing import Dict
+from typing import Dict, Tuple
 
+import numpy as np
 import pandas as pd
+import torch
 
+from autoannot.diarization.diarize_ipus import diarize_ipus
 from autoannot.diarization.diarize_sppas import diarize_sppas
 from autoannot.diarization.diarize_pyannote import diarize_pyannote
-from autoannot.utils.annotations import fill_missing
+from autoannot.utils.annotations import fill_missing, merge_rows
 from autoannot.docs import fill_doc
 
 
 @fill_doc
 def diarize(in_file: str | Path, out_file: str | Path, log_file: None | str | Path, params: Dict) -> None:
     """
-    Perform diarization on ``in_file``. There are three possible backends:
+    Perform diarization on ``in_file``. There are four possible backends:
 
     ``\"sppas\"``: Perform SPPAS IPU annotation (see https://sppas.org/workdemo.html)
+    ``\"ipus\"``: Perform the same IPU annotation as SPPAS implemented in NumPy (faster, uses the SPPAS parameters)
     ``\"pyannot\"``: Perform diarization with Pyannote (see https://github.com/pyannote/pyannote-audio)
     ``\"combined\"``: Perform diarization using both SPPAS and Pyannote and combine the two afterwards
 
@@ -36,6 +40,9 @@ def diarize(in_file: str | Path, out_file: str | Path, log_file: None | str | Pa
     if backend == "sppas":
         diarize_sppas(in_file, out_file, log_file, **params["diarization"]["sppas"])
 
+    elif backend == "ipus":
+        diarize_ipus(in_file, out_file, log_file, **params["diarization"]["sppas"])
+
     elif backend == "pyannot":
         diarize_pyannote(in_file, out_file, **params["diarization"]["pyannote"])
 
@@ -68,24 +75,43 @@ def _diarize_combined(in_file: str | Path, out_file: str | Path, log_file: str |
     None
     """
 
-    with tempfile.TemporaryDirectory() as temp_dir:
+    # The number of torch threads is process-wide: set it here once rather than from the Pyannote thread
+    pyannote_kwargs = {**kwargs["pyannote"], "n_threads": None}
+    n_threads = kwargs["pyannote"].get("n_threads")
+
+    default_n_threads = torch.get_num_threads()
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+
+    # Both diarizations are independent: run them concurrently (SPPAS is single-threaded, Pyannote mostly runs in
+    # torch threads) and keep them in memory, only the combined one is written
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+
+            sppas_future = executor.submit(diarize_sppas, in_file, None, log_file, **kwargs["sppas"])
+            pyannote_future = executor.submit(diarize_pyannote, in_file, None, **pyannote_kwargs)
+
+            sppas_df = sppas_future.result()
+            pyannote_df = pyannote_future.result()
+
+    finally:
+        torch.set_num_threads(default_n_threads)
 
-        temp_dir = Path(temp_dir)
-        diarize_sppas(in_file, temp_dir / "sppas.csv", log_file, **kwargs["sppas"])
-        diarize_pyannote(in_file, temp_dir / "pyannote.csv", **kwargs["pyannote"])
-        _combine(temp_dir / "sppas.csv", temp_dir / "pyannote.csv", out_file, **kwargs["combined"])
+    _combine(sppas_df, pyannote_df, out_file, **kwargs["combined"])
 
 
 @fill_doc
-def _combine(sppas_file: str | Path, pyannote_file: str | Path, out_file: str | Path, tier_name: str = "combined",
+def _combine(sppas_df: pd.DataFrame, pyannote_df: pd.DataFrame, out_file: str | Path, tier_name: str = "combined",
              min_duration: float = 0.0) -> None:
     """
-    Combine SPPAS and Pyannote diarization files
+    Combine SPPAS and Pyannote diarizations
 
     Parameters
     ----------
-    %(sppas_file)s
-    %(pyannote_file)s
+    sppas_df : pd.DataFrame
+        SPPAS diarization
+    pyannote_df : pd.DataFrame
+        Pyannote diarization
     %(out_file)s
     %(tier_name)s
     %(min_duration)s
@@ -95,9 +121,6 @@ def _combine(sppas_file: str | Path, pyannote_file: str | Path, out_file: str |
     None
     """
 
-    sppas_df = pd.read_csv(sppas_file, header=None, names=["tier", "start", "end", "annotation"])
-    pyannote_df = pd.read_csv(pyannote_file)
-
     # If main_speaker is not found use dataframe is empty -> use SPPAS alone
     if len(pyannote_df.index) == 0:
 
@@ -105,67 +128,86 @@ def _combine(sppas_file: str | Path, pyannote_file: str | Path, out_file: str |
         sppas_df.to_csv(out_file, index=False, header=False, quoting=csv.QUOTE_NONNUMERIC)
         return
 
-    # Move the `cursor` to next closest boundary one by one and compare current annotations
-    cursor = 0.0
-    last = min(sppas_df.iloc[-1]["end"], pyannote_df.iloc[-1]["end"])  # last timestamp
-    tier_list, start_list, end_list, annotation_list = [], [], [], []
+    # Sweep over the boundaries of both tiers and compare current annotations
+    start, end, silence = _sweep(sppas_df, pyannote_df)
+    annotation = np.where(silence, "#", "ipu")
 
-    while cursor < last:
+    df = pd.DataFrame({"tier": tier_name, "start": start, "end": end, "annotation": annotation})
+    df = df[df["start"] + min_duration < df["end"]]
+    df = fill_missing(df, target=None)
+    df = merge_rows(df)
 
-        # Possible intervals in which `cursor` can be in
-        sppas_match = sppas_df[(sppas_df["start"] <= cursor) & (cursor < sppas_df["end"])]
-        pyannot_match = pyannote_df[(pyannote_df["start"] <= cursor) & (cursor < pyannote_df["end"])]
+    # Save
+    df.to_csv(out_file, index=False)
 
-        if len(sppas_match.index) > 0:
 
-            sppas_annotation = sppas_match.iloc[0]["annotation"]
-            sppas_start = sppas_match.iloc[0]["start"]
-            sppas_end = sppas_match.iloc[0]["end"]
+@fill_doc
+def _sweep(sppas_df: pd.DataFrame, pyannote_df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Move a `cursor` to the next closest boundary of either tier and return the intervals in between
 
-        else:
-            raise ValueError(f"Cursor {cursor} not in any interval in SPPAS")
+    Both tiers are walked with one pointer each: since the cursor only moves forward, an interval that ends before the
+    cursor can never match again, so each pointer only moves forward too and the sweep is linear in the number of rows.
+    The interval matching the cursor is the first one (in order of start) that contains it.
 
-        if len(pyannot_match.index) > 0:
+    Parameters
+    ----------
+    sppas_df : pd.DataFrame
+        SPPAS diarization, ``\"#\"`` marks silences
+    pyannote_df : pd.DataFrame
+        Pyannote diarization, ``\"#\"`` marks silences
 
-            pyannot_annotation = pyannot_match.iloc[0]["annotation"]
-            pyannot_start = pyannot_match.iloc[0]["start"]
-            pyannot_end = pyannot_match.iloc[0]["end"]
+    Returns
+    -------
+    start : np.ndarray
+        Start of each interval
+    end : np.ndarray
+        End of each interval
+    silence : np.ndarray
+        ``True`` where at least one of the tiers is silent
+    """
 
-        else:
-            raise ValueError(f"Cursor {cursor} not in any interval in Pyannote")
+    sppas_start, sppas_end, sppas_silence = _get_arrays(sppas_df)
+    pyannot_start, pyannot_end, pyannot_silence = _get_arrays(pyannote_df)
+    n_sppas, n_pyannot = len(sppas_start), len(pyannot_start)
 
-        # Only accept IPUs if both annotations agree
-        current_annotation = "#" if sppas_annotation == "#" or pyannot_annotation == "#" else "ipu"
+    last = min(sppas_end[-1], pyannot_end[-1])  # last timestamp
 
-        # Select timestamps after cursor and remove duplicates
-        timestamps = [sppas_start, sppas_end, pyannot_start, pyannot_end, cursor]
-        timestamps = [item for item in timestamps if item >= cursor]
-        timestamps = list(set(timestamps))
-        timestamps.sort()
+    # The cursor only ever lands on an end, so there cannot be more intervals than rows
+    start = np.empty(n_sppas + n_pyannot, dtype=float)
+    end = np.empty(n_sppas + n_pyannot, dtype=float)
+    silence = np.empty(n_sppas + n_pyannot, dtype=bool)
 
-        start = timestamps[0]
-        end = timestamps[1]  # noqa
+    cursor = 0.0
+    i = j = k = 0
+    while cursor < last:
 
-        tier_list.append(tier_name)
-        start_list.append(start)
-        end_list.append(end)
-        annotation_list.append(current_annotation)
+        # Skip intervals that are entirely behind the cursor
+        while i < n_sppas and sppas_end[i] <= cursor:
+            i += 1
+        while j < n_pyannot and pyannot_end[j] <= cursor:
+            j += 1
 
-        cursor = end
+        if i == n_sppas or sppas_start[i] > cursor:
+            raise ValueError(f"Cursor {cursor} not in any interval in SPPAS")
 
-    df = pd.DataFrame({"tier": tier_list, "start": start_list, "end": end_list, "annotation": annotation_list})
-    df = df[df["start"] + min_duration < df["end"]]
-    df = fill_missing(df, target=None)
-    df = _merge_rows(df)
+        if j == n_pyannot or pyannot_start[j] > cursor:
+            raise ValueError(f"Cursor {cursor} not in any interval in Pyannote")
 
-    # Save
-    df.to_csv(out_file, index=False)
+        # Only accept IPUs if both annotations agree
+        start[k] = cursor
+        cursor = min(sppas_end[i], pyannot_end[j])
+        end[k] = cursor
+        silence[k] = sppas_silence[i] or pyannot_silence[j]
+        k += 1
+
+    return start[:k], end[:k], silence[:k]
 
 
 @fill_doc
-def _merge_rows(df: pd.DataFrame) -> pd.DataFrame:
+def _get_arrays(df: pd.DataFrame) -> Tuple[list, list, list]:
     """
-    Merge identical rows that are next to each other
+    Get start, end and silence of each row ordered by start (as lists, which are faster to index one by one)
 
     Parameters
     ----------
@@ -173,40 +215,18 @@ def _merge_rows(df: pd.DataFrame) -> pd.DataFrame:
 
     Returns
     -------
-    %(df)s
+    start : list
+        Start of each row
+    end : list
+        End of each row
+    silence : list
+        ``True`` if the row is a silence
     """
 
-    if not len(df):
-        return df
-
-    tier_name = df.iloc[0]["tier"]
-    current_annotation = None
-    last_start = 0.0
-
-    result = {"tier": [], "start": [], "end": [], "annotation": []}
-
-    for _, row in df.iterrows():
-
-        if current_annotation is None:
-            current_annotation = row["annotation"]
-            last_start = row["start"]
-            continue
-
-        if current_annotation == row["annotation"]:
-            continue
-
-        result["tier"].append(tier_name)
-        result["start"].append(last_start)
-        result["end"].append(row["start"])
-        result["annotation"].append(current_annotation)
-
-        current_annotation = row["annotation"]
-        last_start = row["start"]
+    order = np.argsort(df["start"].to_numpy(dtype=float), kind="stable")
 
-    # The last one
-    result["tier"].append(tier_name)
-    result["start"].append(df.iloc[-1]["start"])
-    result["end"].append(df.iloc[-1]["end"])
-    result["annotation"].append(df.iloc[-1]["annotation"])
+    start = df["start"].to_numpy(dtype=float)[order].tolist()
+    end = df["end"].to_numpy(dtype=float)[order].tolist()
+    silence = (df["annotation"].to_numpy() == "#")[order].tolist()
 
-    return pd.DataFrame(result)
+    return start, end, silence
@@ -0,0 +1,450 @@
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from autoannot.diarization.quality import check_quality, load_manual_thresholds, record_quality, record_threshold
+from autoannot.docs import fill_doc
+from autoannot.utils.audio import load_audio
+from . import THRESHOLD_GRID, WIN_LENGTH, MIN_SIL, MIN_IPU, SHIFT_START, SHIFT_END, MIN_MEAN_DURATION, MIN_N_IPUS
+
+
+@fill_doc
+def diarize_ipus(in_file: str | Path, out_file: None | str | Path, error_log: str | Path,
+                 min_sil: None | float = None, min_ipu: None | float = None,
+                 shift_start: None | float = None, shift_end: None | float = None,
+                 min_n_ipus: None | int = None, min_mean_duration: None | float = None,
+                 rms: None | float = None, manual_thresholds: None | str | Path = None,
+                 threshold_search: bool = False) -> pd.DataFrame:
+    """
+    Perform IPU annotation with the SPPAS algorithm (see https://sppas.org/workdemo.html) implemented in NumPy
+
+    Takes the same parameters as ``diarize_sppas`` and writes the same CSV format, thresholds are in the same unit
+    (RMS of 16-bit samples) so manual thresholds can be shared between both backends
+
+    Parameters
+    ----------
+    %(in_file)s
+    out_file : None | str | Path
+        Path to output file, if ``None`` nothing is written
+    error_log : str | Path
+        Path to SPPAS error log file, records are only added to it by ``merge_quality_log``
+    min_sil : None | float
+        Minimum silence duration
+    min_ipu : None | float
+        Minimum IPU duration
+    shift_start : None | float
+        Shift start
+    shift_end : None | float
+        Shift end
+    min_n_ipus : None | float
+        Minimum number of IPUs
+    %(min_mean_duration)s
+    rms : None | float
+        RMS, overrides the manual thresholds
+    manual_thresholds : None | str | Path
+        Path to file containing manual threshold if None, it is ignored
+    %(threshold_search)s
+
+    Returns
+    -------
+    %(df)s
+    """
+
+    # Set default parameters
+    if min_n_ipus is None:
+        min_n_ipus = MIN_N_IPUS
+
+    if min_mean_duration is None:
+        min_mean_duration = MIN_MEAN_DURATION
+
+    # Set manual threshold if available (0 to estimate it)
+    basename = os.path.basename(in_file)
+
+    threshold = 0
+    if manual_thresholds is not None:
+        threshold = load_manual_thresholds(manual_thresholds).get(basename, 0)
+
+    if rms is not None:
+        threshold = rms
+
+    # Annotate #########################################################################################################
+
+    wav_data, sample_rate = read_wav(in_file)
+    duration = len(wav_data) / sample_rate
+
+    start, end = search_ipus(wav_data, sample_rate, threshold=threshold, min_sil=min_sil, min_ipu=min_ipu,
+                             shift_start=shift_start, shift_end=shift_end)
+    df = _to_df(start, end, duration)
+
+    # Check if reasonable number of IPUs have been found ###############################################################
+
+    n_ipus, quality_ok = check_quality(df, min_n_ipus, min_mean_duration)
+
+    if not quality_ok and threshold_search:
+        threshold = search_threshold(wav_data, sample_rate, min_n_ipus, min_mean_duration, min_sil=min_sil,
+                                     min_ipu=min_ipu, shift_start=shift_start, shift_end=shift_end)
+
+        if threshold is not None:
+            if manual_thresholds is not None:
+                record_threshold(manual_thresholds, basename, threshold)
+
+            start, end = search_ipus(wav_data, sample_rate, threshold=threshold, min_sil=min_sil, min_ipu=min_ipu,
+                                     shift_start=shift_start, shift_end=shift_end)
+            df = _to_df(start, end, duration)
+            n_ipus, quality_ok = check_quality(df, min_n_ipus, min_mean_duration)
+
+    if out_file is not None:
+        df.to_csv(out_file, index=False, header=False, quoting=csv.QUOTE_NONNUMERIC)
+
+    record_quality(error_log, basename, n_ipus, quality_ok)
+
+    return df
+
+
+@fill_doc
+def read_wav(wav_file: str | Path) -> Tuple[np.ndarray, int]:
+    """
+    Read a WAV file as mono samples on the 16-bit scale used by SPPAS thresholds
+
+    Parameters
+    ----------
+    %(wav_file)s
+
+    Returns
+    -------
+    %(wav_data)s
+    %(sample_rate)s
+    """
+
+    # Decoded once (shared with the other stages), mono between -1 and 1
+    wav_data, sample_rate = load_audio(wav_file)
+
+    return wav_data * np.float32(2 ** 15), sample_rate
+
+
+@fill_doc
+def get_rms(wav_data: np.ndarray, sample_rate: int, win_length: float = WIN_LENGTH) -> np.ndarray:
+    """
+    Get the RMS of each window of ``win_length`` seconds (the last incomplete window is ignored)
+
+    Parameters
+    ----------
+    %(wav_data)s
+    %(sample_rate)s
+    win_length : float
+        Window length in seconds
+
+    Returns
+    -------
+    rms : np.ndarray
+        RMS of each window
+    """
+
+    n_samples = int(win_length * sample_rate)
+    n_windows = len(wav_data) // n_samples
+
+    frames = wav_data[:n_windows * n_samples].reshape(n_windows, n_samples)
+
+    return np.sqrt(np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / n_samples)
+
+
+def estimate_threshold(rms: np.ndarray) -> float:
+    """
+    Estimate the silence threshold from the RMS values the same way as SPPAS: minimum plus a fifth of the mean minus
+    1.5 times the coefficient of variation (in percent)
+
+    Parameters
+    ----------
+    rms : np.ndarray
+        RMS of each window
+
+    Returns
+    -------
+    threshold : float
+        RMS threshold under which windows are silent
+    """
+
+    if len(rms) == 0:
+        return 0.0
+
+    v_min = rms.min()
+    v_mean = rms.mean()
+    v_coef_var = 100. * rms.std() / v_mean if v_mean > 0 else 0.0
+
+    alt = (v_mean - 1.5 * v_coef_var) / 5.
+    if alt <= 0:  # very low volume or very variable signal
+        alt = v_mean / 5.
+
+    return float(int(v_min) + int(alt))
+
+
+@fill_doc
+def search_ipus(wav_data: np.ndarray, sample_rate: int, threshold: float = 0,
+                min_sil: None | float = None, min_ipu: None | float = None,
+                shift_start: None | float = None, shift_end: None | float = None,
+                win_length: float = WIN_LENGTH) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search inter-pausal units (IPUs) from the framewise RMS
+
+    Windows under ``threshold`` are silent, then silences shorter than ``min_sil`` are turned into speech and IPUs
+    shorter than ``min_ipu`` into silence. IPU boundaries are finally moved by ``shift_start`` and ``shift_end``.
+
+    Parameters
+    ----------
+    %(wav_data)s
+    %(sample_rate)s
+    threshold : float
+        RMS threshold, if ``0`` it is estimated
+    min_sil : None | float
+        Minimum silence duration
+    min_ipu : None | float
+        Minimum IPU duration
+    shift_start : None | float
+        Shift start
+    shift_end : None | float
+        Shift end
+    win_length : float
+        Window length in seconds
+
+    Returns
+    -------
+    start : np.ndarray
+        Start of each IPU
+    end : np.ndarray
+        End of each IPU
+    """
+
+    # Set default parameters
+    min_sil = MIN_SIL if min_sil is None else min_sil
+    min_ipu = MIN_IPU if min_ipu is None else min_ipu
+    shift_start = SHIFT_START if shift_start is None else shift_start
+    shift_end = SHIFT_END if shift_end is None else shift_end
+
+    rms = get_rms(wav_data, sample_rate, win_length)
+
+    if threshold == 0:
+        threshold = estimate_threshold(rms)
+
+    return _search_ipus(rms, threshold, min_sil, min_ipu, shift_start, shift_end, win_length,
+                        duration=len(wav_data) / sample_rate)
+
+
+@fill_doc
+def search_threshold(wav_data: np.ndarray, sample_rate: int, min_n_ipus: int, min_mean_duration: float,
+                     min_sil: None | float = None, min_ipu: None | float = None,
+                     shift_start: None | float = None, shift_end: None | float = None,
+                     thresholds: None | List[float] = None, n_jobs: None | int = None,
+                     win_length: float = WIN_LENGTH) -> None | float:
+    """
+    Search an RMS threshold for which the IPUs pass the quality check
+
+    The RMS is computed once and every threshold of the grid is evaluated in parallel. Among the thresholds passing the
+    check, the closest one to the estimated threshold (in ratio) is returned, as it changes the least the IPUs that
+    would have been found automatically.
+
+    Parameters
+    ----------
+    %(wav_data)s
+    %(sample_rate)s
+    min_n_ipus : int
+        Minimum number of IPUs
+    %(min_mean_duration)s
+    min_sil : None | float
+        Minimum silence duration
+    min_ipu : None | float
+        Minimum IPU duration
+    shift_start : None | float
+        Shift start
+    shift_end : None | float
+        Shift end
+    thresholds : None | List[float]
+        Thresholds to evaluate, if ``None`` the estimated threshold multiplied by each factor of ``THRESHOLD_GRID``
+    n_jobs : None | int
+        Number of threads, if ``None`` the default of ``ThreadPoolExecutor``
+    win_length : float
+        Window length in seconds
+
+    Returns
+    -------
+    threshold : None | float
+        Best threshold, ``None`` if none of them passes the quality check
+    """
+
+    # Set default parameters
+    min_sil = MIN_SIL if min_sil is None else min_sil
+    min_ipu = MIN_IPU if min_ipu is None else min_ipu
+    shift_start = SHIFT_START if shift_start is None else shift_start
+    shift_end = SHIFT_END if shift_end is None else shift_end
+
+    rms = get_rms(wav_data, sample_rate, win_length)
+    duration = len(wav_data) / sample_rate
+
+    estimate = max(estimate_threshold(rms), 1.0)
+    if thresholds is None:
+        thresholds = [estimate * factor for factor in THRESHOLD_GRID]
+
+    thresholds = np.unique(np.asarray(thresholds, dtype=float))
+    thresholds = thresholds[thresholds > 0]
+
+    def _evaluate(threshold):
+        """Quality check of the IPUs found with ``threshold``"""
+        start, end = _search_ipus(rms, threshold, min_sil, min_ipu, shift_start, shift_end, win_length, duration)
+        return check_quality(_to_df(start, end, duration), min_n_ipus, min_mean_duration)[1]
+
+    # NumPy releases the GIL in the heavy operations so threads are enough
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        passed = np.fromiter(executor.map(_evaluate, thresholds), dtype=bool, count=len(thresholds))
+
+    if not passed.any():
+        return None
+
+    candidates = thresholds[passed]
+
+    return float(candidates[np.argmin(np.abs(np.log(candidates / estimate)))])
+
+
+########################################################################################################################
+# Private methods                                                                                                      #
+########################################################################################################################
+
+
+def _search_ipus(rms: np.ndarray, threshold: float, min_sil: float, min_ipu: float, shift_start: float,
+                 shift_end: float, win_length: float, duration: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search IPUs from the framewise RMS (see ``search_ipus``)
+
+    Parameters
+    ----------
+    rms : np.ndarray
+        RMS of each window
+    threshold : float
+        RMS threshold
+    min_sil : float
+        Minimum silence duration
+    min_ipu : float
+        Minimum IPU duration
+    shift_start : float
+        Shift start
+    shift_end : float
+        Shift end
+    win_length : float
+        Window length in seconds
+    duration : float
+        Duration of the audio in seconds
+
+    Returns
+    -------
+    start : np.ndarray
+        Start of each IPU
+    end : np.ndarray
+        End of each IPU
+    """
+
+    speech = rms >= threshold
+
+    # Silences that are too short are part of the IPU (only between two IPUs)
+    sil_start, sil_end = _get_runs(~speech)
+    short = (sil_end - sil_start) * win_length < min_sil
+    short &= (sil_start > 0) & (sil_end < len(speech))
+    speech |= _get_mask(sil_start[short], sil_end[short], len(speech))
+
+    # IPUs that are too short are silences
+    ipu_start, ipu_end = _get_runs(speech)
+    short = (ipu_end - ipu_start) * win_length < min_ipu
+    speech &= ~_get_mask(ipu_start[short], ipu_end[short], len(speech))
+
+    # Shift boundaries without overlapping the neighbouring IPUs
+    ipu_start, ipu_end = _get_runs(speech)
+    start = np.clip(ipu_start * win_length - shift_start, 0.0, duration)
+    end = np.clip(ipu_end * win_length + shift_end, 0.0, duration)
+
+    if len(start) > 1:
+        start[1:] = np.maximum(start[1:], end[:-1])
+
+    return start, end
+
+
+def _get_runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the first index and the index after the last of each run of ``True`` in ``mask``
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        Boolean mask
+
+    Returns
+    -------
+    start : np.ndarray
+        First index of each run
+    end : np.ndarray
+        Index after the last of each run
+    """
+
+    change = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+
+    return np.flatnonzero(change == 1), np.flatnonzero(change == -1)
+
+
+def _get_mask(start: np.ndarray, end: np.ndarray, size: int) -> np.ndarray:
+    """
+    Make a boolean mask that is ``True`` in each run from ``start`` to ``end`` (exclusive)
+
+    Parameters
+    ----------
+    start : np.ndarray
+        First index of each run
+    end : np.ndarray
+        Index after the last of each run
+    size : int
+        Size of the mask
+
+    Returns
+    -------
+    mask : np.ndarray
+        Boolean mask
+    """
+
+    delta = np.zeros(size + 1, dtype=int)
+    np.add.at(delta, start, 1)
+    np.add.at(delta, end, -1)
+
+    return np.cumsum(delta[:-1]) > 0
+
+
+@fill_doc
+def _to_df(start: np.ndarray, end: np.ndarray, duration: float, tier_name: str = "IPUs") -> pd.DataFrame:
+    """
+    Make an IPU tier covering the whole audio, with ``\"#\"`` between the IPUs
+
+    Parameters
+    ----------
+    start : np.ndarray
+        Start of each IPU
+    end : np.ndarray
+        End of each IPU
+    duration : float
+        Duration of the audio in seconds
+    tier_name : str
+        Name of the tier
+
+    Returns
+    -------
+    %(df)s
+    """
+
+    # Boundaries alternate silence / IPU: 0, start_1, end_1, start_2, ... , duration
+    boundaries = np.concatenate([[0.0], np.column_stack([start, end]).ravel(), [duration]])
+    annotation = np.empty(len(boundaries) - 1, dtype=object)
+    annotation[0::2] = "#"
+    annotation[1::2] = [f"ipu_{i + 1}" for i in range(len(start))]
+
+    df = pd.DataFrame({"tier": tier_name, "start": boundaries[:-1], "end": boundaries[1:], "annotation": annotation})
+
+    # Remove empty silences (IPU touching the beginning, the end or the next IPU)
+    return df[df["start"] < df["end"]].reset_index(drop=True)
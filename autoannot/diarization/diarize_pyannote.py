@@ -1,56 +1,104 @@
 import csv
 from pathlib import Path
-import re
 from typing import Tuple
 
-import librosa
 import numpy as np
 import torch
 import pandas as pd
 from pyannote.audio import Pipeline
+from pyannote.core import Annotation
 
-from . import PYANNOT_MODEL
+from . import PYANNOT_MODEL, PYANNOT_SAMPLE_RATE
 from autoannot.utils.annotations import fill_missing
+from autoannot.utils.audio import load_audio
+from autoannot.utils.models import get_device, get_model
 from autoannot.docs import fill_doc
 
 
 @fill_doc
-def diarize_pyannote(in_file: str | Path, out_file: str | Path,  max_speakers: None | int,
-                     auth_token: str, use_cuda: bool = True) -> None:
+def diarize_pyannote(in_file: str | Path, out_file: None | str | Path,  max_speakers: None | int,
+                     auth_token: str, use_cuda: bool = True, n_threads: None | int = None) -> pd.DataFrame:
     """
     Perform diarization using Pyannote
 
     Parameters
     ----------
     %(in_file)s
-    %(out_file)s
+    out_file : None | str | Path
+        Path to output file, if ``None`` nothing is written
     max_speakers) : None | int
         Maximum number of speakers in the file, if is unknown ``None`` is specified
     auth_token) : str
         Authentication token for HuggingFace
     %(use_cuda)s
+    n_threads : None | int
+        Maximum number of threads used by torch during the diarization, if ``None`` torch's default is used
 
     Returns
     -------
-    None
+    %(df)s
     """
 
-    # Load pretrained model
-    pipeline = Pipeline.from_pretrained(checkpoint_path=PYANNOT_MODEL, use_auth_token=auth_token)
-
-    # Use CUDA
-    if torch.cuda.is_available() and use_cuda:
-        pipeline.to(torch.device("cuda"))
+    # Load pretrained model (once per process)
+    pipeline = load_pipeline(auth_token, use_cuda)
 
     # Set maximum number of speakers
     max_speakers = 10 if max_speakers is None else max_speakers
 
-    # Annotate
-    diarization = pipeline(in_file, max_speakers=max_speakers)
+    # Annotate (limiting torch threads e.g. to leave cores for SPPAS running alongside)
+    default_n_threads = torch.get_num_threads()
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+
+    # Audio decoded once (shared with the other stages), Pyannote resamples it if needed
+    wav_data, sample_rate = load_audio(in_file, PYANNOT_SAMPLE_RATE)
+    audio = {"waveform": torch.from_numpy(np.array(wav_data))[None], "sample_rate": sample_rate}
+
+    try:
+        diarization = pipeline(audio, max_speakers=max_speakers)
+
+    finally:
+        torch.set_num_threads(default_n_threads)
 
     # Convert to familiar dataframe
-    dia_df = _convert_to_df(str(diarization))
-    dia_df.to_csv(out_file, index=False, quoting=csv.QUOTE_NONNUMERIC)
+    dia_df = _convert_to_df(diarization)
+
+    if out_file is not None:
+        dia_df.to_csv(out_file, index=False, quoting=csv.QUOTE_NONNUMERIC)
+
+    return dia_df
+
+
+def load_pipeline(auth_token: str, use_cuda: bool = True) -> Pipeline:
+    """
+    Get the pretrained Pyannote pipeline from the model registry
+
+    Parameters
+    ----------
+    auth_token : str
+        Authentication token for HuggingFace
+    use_cuda : bool
+        if ``True``, use GPU (if available)
+
+    Returns
+    -------
+    pipeline : Pipeline
+        Pretrained pipeline, ``None`` if it could not be loaded
+    """
+
+    device = get_device(use_cuda)
+
+    def _load():
+
+        pipeline = Pipeline.from_pretrained(checkpoint_path=PYANNOT_MODEL, use_auth_token=auth_token)
+
+        # Use CUDA
+        if pipeline is not None and device == "cuda":
+            pipeline.to(torch.device(device))
+
+        return pipeline
+
+    return get_model("pyannote", PYANNOT_MODEL, device, loader=_load)
 
 
 @fill_doc
@@ -120,13 +168,14 @@ def get_main_speaker(diarization_file: str | Path, wav_file: str | Path,
 
 
 @fill_doc
-def _convert_to_df(diarization: str, tier_name: str = "pyannote") -> pd.DataFrame:
+def _convert_to_df(diarization: Annotation, tier_name: str = "pyannote") -> pd.DataFrame:
     """
     Convert Pyannote output to DataFrame format
 
     Parameters
     ----------
-    %(diarization)s
+    diarization : Annotation
+        Pyannote diarization result
     %(tier_name)s
 
     Returns
@@ -134,36 +183,15 @@ def _convert_to_df(diarization: str, tier_name: str = "pyannote") -> pd.DataFram
     %(df)s
     """
 
-    results = {"tier": [], "start": [], "end": [], "annotation": []}
-
-    for line in diarization.splitlines():
-
-        # e.g. [ 00:00:00.722 -->  00:00:03.372] A SPEAKER_01
-        pattern = r"\[\s(\d{2}):(\d{2}):(\d+\.\d+)\s+-->\s+(\d{2}):(\d{2}):(\d+\.\d+)]\s\w+\s(SPEAKER_\d{2})"
-        match = re.match(pattern, line)
-
-        if not match:
-            raise ValueError(f"Unmatched line '{line}' in annotation result")
+    # Read the segments directly from the annotation (sorted by segment)
+    tracks = list(diarization.itertracks(yield_label=True))
+    n_tracks = len(tracks)
 
-        # Extract the time
-        start_hour = float(match.group(1))
-        start_min = float(match.group(2))
-        start_sec = float(match.group(3))
-        end_hour = float(match.group(4))
-        end_min = float(match.group(5))
-        end_sec = float(match.group(6))
-        speaker = match.group(7)
+    start = np.fromiter((segment.start for segment, _, _ in tracks), dtype=float, count=n_tracks)
+    end = np.fromiter((segment.end for segment, _, _ in tracks), dtype=float, count=n_tracks)
+    speaker = np.fromiter((str(label) for _, _, label in tracks), dtype=object, count=n_tracks)
 
-        # To time in seconds
-        start = start_hour * 3600 + start_min * 60 + start_sec
-        end = end_hour * 3600 + end_min * 60 + end_sec
-
-        results["tier"].append(tier_name)
-        results["start"].append(start)
-        results["end"].append(end)
-        results["annotation"].append(speaker)
-
-    results = pd.DataFrame(results)
+    results = pd.DataFrame({"tier": tier_name, "start": start, "end": end, "annotation": speaker})
     results = fill_missing(results, target=None)  # fill missing silence with #
 
     return results
@@ -172,6 +200,7 @@ def _convert_to_df(diarization: str, tier_name: str = "pyannote") -> pd.DataFram
 @fill_doc
 def _get_df(diarization_file: str | Path, wav_file: str | Path) -> pd.DataFrame:
     """
+    Get average intensity and total duration of each speaker
 
     Parameters
     ----------
@@ -183,54 +212,37 @@ def _get_df(diarization_file: str | Path, wav_file: str | Path) -> pd.DataFrame:
     %(df)s
     """
 
-    # Load data
+    # Load data (at native sample rate)
     diarization_df = pd.read_csv(diarization_file)
-    wav_data, sample_rate = librosa.load(wav_file)
-
-    # List of all unique speakers
-    speakers = list(set(diarization_df["annotation"]))
-
-    speaker_list, intensity_list, duration_list = [], [], []
-
-    # Work speaker by speaker
-    for speaker in speakers:
-
-        # Select speaker
-        speaker_df = diarization_df[diarization_df["annotation"] == speaker]
-
-        # Intensity and duration per speaker
-        speaker_intensity_list, speaker_duration_list = [], []
-        for idx, row in speaker_df.iterrows():
-
-            intensity = _get_intensity(row["start"], row["end"], wav_data, sample_rate)
-            speaker_intensity_list.append(intensity)
-            speaker_duration_list.append(row["end"] - row["start"])
-
-        # Average intensity
-        intensity = np.array(speaker_intensity_list).mean() if len(speaker_intensity_list) != 0 else 0
+    wav_data, sample_rate = load_audio(wav_file)
 
-        # Total duration
-        duration = np.array(speaker_duration_list).sum()
+    # Cumulative sum of the absolute amplitude to get the mean of any segment in constant time
+    cumsum = np.concatenate([[0.0], np.cumsum(np.abs(wav_data), dtype=np.float64)])
 
-        # Save
-        speaker_list.append(speaker)
-        intensity_list.append(intensity)
-        duration_list.append(duration)
+    segment_df = pd.DataFrame({"speaker": diarization_df["annotation"],
+                               "intensity": _get_intensity(diarization_df["start"].to_numpy(dtype=float),
+                                                           diarization_df["end"].to_numpy(dtype=float),
+                                                           cumsum, sample_rate),
+                               "duration": diarization_df["end"] - diarization_df["start"]})
 
-    result_df = pd.DataFrame({"speaker": speaker_list, "intensity": intensity_list, "duration": duration_list})
+    # Average intensity and total duration per speaker
+    result_df = segment_df.groupby("speaker", sort=False).agg(intensity=("intensity", "mean"),
+                                                              duration=("duration", "sum")).reset_index()
 
     return result_df
 
 
 @fill_doc
-def _get_intensity(start: float, end: float, wav_data: np.ndarray, sample_rate: int) -> float:
+def _get_intensity(start: np.ndarray, end: np.ndarray, cumsum: np.ndarray, sample_rate: int) -> np.ndarray:
     """
+    Get the mean absolute amplitude between ``start`` and ``end`` of each segment
 
     Parameters
     ----------
     %(start)s
     %(end)s
-    %(wav_data)s
+    cumsum : np.ndarray
+        Cumulative sum of the absolute amplitude, starting with ``0.0``
     %(sample_rate)s
 
     Returns
@@ -238,7 +250,9 @@ def _get_intensity(start: float, end: float, wav_data: np.ndarray, sample_rate:
     %(intensity)s
     """
 
-    start_idx = int(start * sample_rate)
-    end_idx = int(end * sample_rate)
+    n_samples = len(cumsum) - 1
+    start_idx = np.clip((start * sample_rate).astype(int), 0, n_samples)
+    end_idx = np.clip((end * sample_rate).astype(int), start_idx, n_samples)
 
-    return np.abs(wav_data[start_idx: end_idx]).mean()
+    with np.errstate(invalid="ignore", divide="ignore"):  # empty segments are NaN
+        return (cumsum[end_idx] - cumsum[start_idx]) / (end_idx - start_idx)
@@ -1,33 +1,41 @@
 import os
 from pathlib import Path
 import sys
+from typing import List, Tuple
 
 import pandas as pd
 
 from autoannot.constants import ROOT_DIR
+from autoannot.diarization.diarize_ipus import read_wav, search_threshold
+from autoannot.diarization.quality import check_quality, load_manual_thresholds, record_quality, record_threshold
 from autoannot.docs import fill_doc
+from autoannot.utils.files import trs_to_df
 from . import MIN_SIL, MIN_IPU, SHIFT_START, SHIFT_END, MIN_MEAN_DURATION, MIN_N_IPUS
 
 # Add SPPAS path
 sys.path.append(str(ROOT_DIR / "libs" / "SPPAS"))
 
 from sppas.src.annotations import sppasSearchIPUs  # noqa
+from sppas.src.anndata import sppasTrsRW  # noqa
 
 
 @fill_doc
-def diarize_sppas(in_file: str | Path, out_file: str | Path, error_log: str | Path,
+def diarize_sppas(in_file: str | Path, out_file: None | str | Path, error_log: str | Path,
                   min_sil: None | float = None, min_ipu: None | float = None,
                   shift_start: None | float = None, shift_end: None | float = None,
                   min_n_ipus: None | int = None, min_mean_duration: None | float = None,
-                  rms: None | float = None, manual_thresholds: None | str | Path = None) -> None:
+                  rms: None | float = None, manual_thresholds: None | str | Path = None,
+                  threshold_search: bool = False) -> pd.DataFrame:
     """
+    Perform SPPAS IPU annotation
 
     Parameters
     ----------
     %(in_file)s
-    %(out_file)s
+    out_file : None | str | Path
+        Path to output file, if ``None`` nothing is written
     error_log : str | Path
-        Path to SPPAS error log file
+        Path to SPPAS error log file, records are only added to it by ``merge_quality_log``
     min_sil : None | float
         Minimum silence duration
     min_ipu : None | float
@@ -43,13 +51,151 @@ def diarize_sppas(in_file: str | Path, out_file: str | Path, error_log: str | Pa
         RMS
     manual_thresholds : None | str | Path
         Path to file containing manual threshold if None, it is ignored
+    %(threshold_search)s
 
     Returns
     -------
-    None
+    %(df)s
+    """
+
+    df_list, _ = diarize_sppas_corpus([in_file], [out_file], error_log, min_sil=min_sil, min_ipu=min_ipu,
+                                      shift_start=shift_start, shift_end=shift_end, min_n_ipus=min_n_ipus,
+                                      min_mean_duration=min_mean_duration, rms=rms,
+                                      manual_thresholds=manual_thresholds, threshold_search=threshold_search)
+
+    return df_list[0]
+
+
+@fill_doc
+def diarize_sppas_corpus(in_files: List[str | Path], out_files: None | List[None | str | Path], error_log: str | Path,
+                         min_sil: None | float = None, min_ipu: None | float = None,
+                         shift_start: None | float = None, shift_end: None | float = None,
+                         min_n_ipus: None | int = None, min_mean_duration: None | float = None,
+                         rms: None | float = None, manual_thresholds: None | str | Path = None,
+                         threshold_search: bool = False) -> Tuple[List[pd.DataFrame], pd.DataFrame]:
+    """
+    Perform SPPAS IPU annotation on many files, with a single annotator configured once
+
+    Parameters
+    ----------
+    in_files : List[str | Path]
+        Paths to input files
+    out_files : None | List[None | str | Path]
+        Paths to output files, if ``None`` (or ``None`` for a file) nothing is written
+    error_log : str | Path
+        Path to SPPAS error log file, records are only added to it by ``merge_quality_log``
+    min_sil : None | float
+        Minimum silence duration
+    min_ipu : None | float
+        Minimum IPU duration
+    shift_start : None | float
+        Shift start
+    shift_end : None | float
+        Shift end
+    min_n_ipus : None | float
+        Minimum number of IPUs
+    %(min_mean_duration)s
+    rms : None | float
+        RMS, overrides the manual thresholds
+    manual_thresholds : None | str | Path
+        Path to file containing manual threshold if None, it is ignored
+    %(threshold_search)s
+
+    Returns
+    -------
+    df_list : List[pd.DataFrame]
+        IPU tier of each file
+    quality_df : pd.DataFrame
+        Number of IPUs (``n_ipus``) and quality check (``ok``) of each file (``name``)
+    """
+
+    # Set default parameters
+    if min_n_ipus is None:
+        min_n_ipus = MIN_N_IPUS
+
+    if min_mean_duration is None:
+        min_mean_duration = MIN_MEAN_DURATION
+
+    if out_files is None:
+        out_files = [None] * len(in_files)
+
+    # Make the SPPAS annotator object once for all files
+    annotator = _make_annotator(min_sil=min_sil, min_ipu=min_ipu, shift_start=shift_start, shift_end=shift_end)
+
+    # Manual thresholds
+    manual_dict = {} if manual_thresholds is None else load_manual_thresholds(manual_thresholds)
+
+    df_list = []
+    quality = {"name": [], "n_ipus": [], "ok": []}
+    for in_file, out_file in zip(in_files, out_files):
+
+        basename = os.path.basename(in_file)
+
+        # Set manual threshold if available (0 lets SPPAS estimate it)
+        threshold = manual_dict.get(basename, 0)
+
+        if rms is not None:
+            threshold = rms
+
+        annotator.set_threshold(threshold)
+
+        # Annotate
+        df = _annotate(annotator, in_file, out_file)
+
+        # Check if reasonable number of IPUs have been found
+        n_ipus, quality_ok = check_quality(df, min_n_ipus, min_mean_duration)
+
+        # Search a better threshold on the decoded audio rather than running SPPAS again for each candidate
+        if not quality_ok and threshold_search:
+            wav_data, sample_rate = read_wav(in_file)
+            threshold = search_threshold(wav_data, sample_rate, min_n_ipus, min_mean_duration, min_sil=min_sil,
+                                         min_ipu=min_ipu, shift_start=shift_start, shift_end=shift_end)
+
+            if threshold is not None:
+                if manual_thresholds is not None:
+                    record_threshold(manual_thresholds, basename, threshold)
+
+                annotator.set_threshold(threshold)
+                df = _annotate(annotator, in_file, out_file)
+                n_ipus, quality_ok = check_quality(df, min_n_ipus, min_mean_duration)
+
+        record_quality(error_log, basename, n_ipus, quality_ok)
+
+        df_list.append(df)
+        quality["name"].append(basename)
+        quality["n_ipus"].append(n_ipus)
+        quality["ok"].append(quality_ok)
+
+    return df_list, pd.DataFrame(quality)
+
+
+########################################################################################################################
+# Private methods                                                                                                      #
+########################################################################################################################
+
+
+def _make_annotator(min_sil: None | float = None, min_ipu: None | float = None,
+                    shift_start: None | float = None, shift_end: None | float = None) -> sppasSearchIPUs:
+    """
+    Make the SPPAS annotator object
+
+    Parameters
+    ----------
+    min_sil : None | float
+        Minimum silence duration
+    min_ipu : None | float
+        Minimum IPU duration
+    shift_start : None | float
+        Shift start
+    shift_end : None | float
+        Shift end
+
+    Returns
+    -------
+    annotator : sppasSearchIPUs
+        SPPAS annotator
     """
 
-    # Make the SPPAS annotator object
     annotator = sppasSearchIPUs(log=None)
 
     # Set default parameters
@@ -65,61 +211,44 @@ def diarize_sppas(in_file: str | Path, out_file: str | Path, error_log: str | Pa
     if shift_end is None:
         shift_end = SHIFT_END
 
-    if min_n_ipus is None:
-        min_n_ipus = MIN_N_IPUS
-
-    if min_mean_duration is None:
-        min_mean_duration = MIN_MEAN_DURATION
-
     # Set parameters
     annotator.set_min_sil(min_sil)
     annotator.set_min_ipu(min_ipu)
     annotator.set_shift_start(shift_start)
     annotator.set_shift_end(shift_end)
 
-    # Set manual threshold if available
-    basename = os.path.basename(in_file)
-
-    if manual_thresholds is not None:
+    return annotator
 
-        manual_df = pd.read_csv(manual_thresholds)
 
-        if basename in list(manual_df["file"]):
-            annotator.set_threshold(manual_df[manual_df["file"] == basename].iloc[0]["threshold"])
+@fill_doc
+def _annotate(annotator: sppasSearchIPUs, in_file: str | Path, out_file: None | str | Path) -> pd.DataFrame:
+    """
+    Search IPUs in ``in_file``
 
-    if rms is not None:
-        annotator.set_threshold(rms)
+    Parameters
+    ----------
+    annotator : sppasSearchIPUs
+        SPPAS annotator
+    %(in_file)s
+    out_file : None | str | Path
+        Path to output file, if ``None`` nothing is written
 
-    # Annotate #########################################################################################################
+    Returns
+    -------
+    %(df)s
+    """
 
-    in_file, out_file = str(in_file), str(out_file)
+    df = pd.DataFrame({"tier": [], "start": [], "end": [], "annotation": []})
 
     try:
-        annotator.run([in_file], output=out_file)
+        trs = annotator.run([str(in_file)])  # kept in memory, only written if `out_file` is set
+        df = trs_to_df(trs)
+
+        if out_file is not None:
+            parser = sppasTrsRW(str(out_file))
+            parser.write(trs)
 
     except OSError as e:  # No IPUs to write
         pass
 
-    # Check if reasonable number of IPUs have been found ###############################################################
-
-    df = pd.read_csv(out_file, header=None, names=["tier", "start", "end", "annotation"])
-    n_ipus = len(df.index)
-    mean_duration = df["end"].sub(df["start"], axis=0).mean()
-
-    quality_ok = n_ipus > min_n_ipus and mean_duration < min_mean_duration
-
-    # Write the error log ##############################################################################################
-
-    # Make sure the path exists
-    error_log = Path(error_log)
-    if not error_log.parent.exists():
-        os.makedirs(error_log.parent)
-
-        # Write the header
-        with open(error_log, "w") as f:
-            f.write(f"name,n_ipus,ok\n")
-
-    # Write the result
-    with open(error_log, "a") as f:
-        fname = os.path.basename(in_file)
-        f.write(f"{fname},{n_ipus},{quality_ok}\n")
+    return df
@@ -0,0 +1,190 @@
+import glob
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Tuple
+
+import pandas as pd
+
+from autoannot.docs import fill_doc
+from autoannot.utils.files import lock_file
+
+# SPPAS error log
+QUALITY_HEADER = "name,n_ipus,ok"
+QUALITY_SHARD_SUFFIX = ".part"
+
+# Manual thresholds already read, path -> (modification time, {file name: threshold})
+_MANUAL_THRESHOLDS: Dict[str, Tuple[int, Dict[str, float]]] = {}
+_MANUAL_THRESHOLDS_LOCK = threading.Lock()
+
+
+@fill_doc
+def check_quality(df: pd.DataFrame, min_n_ipus: int, min_mean_duration: float) -> Tuple[int, bool]:
+    """
+    Check if reasonable number of IPUs have been found
+
+    Parameters
+    ----------
+    %(df)s
+    min_n_ipus : int
+        Minimum number of IPUs
+    %(min_mean_duration)s
+
+    Returns
+    -------
+    n_ipus : int
+        Number of IPUs (all intervals of the tier)
+    quality_ok : bool
+        ``True`` if there are more than ``min_n_ipus`` IPUs shorter than ``min_mean_duration`` on average
+    """
+
+    n_ipus = len(df.index)
+    mean_duration = df["end"].sub(df["start"], axis=0).mean()
+
+    quality_ok = n_ipus > min_n_ipus and mean_duration < min_mean_duration
+
+    return n_ipus, bool(quality_ok)
+
+
+def load_manual_thresholds(manual_thresholds: str | Path) -> Dict[str, float]:
+    """
+    Load the manual thresholds file as a dictionary keyed by file name
+
+    The file is only read again when it has been modified, the dictionary is shared by every caller in the process. A
+    file that does not exist yet (e.g. before ``record_threshold`` is first called) has no thresholds.
+
+    Parameters
+    ----------
+    manual_thresholds : str | Path
+        Path to file containing manual threshold (columns ``file`` and ``threshold``)
+
+    Returns
+    -------
+    manual_dict : Dict[str, float]
+        Threshold of each file name (the first one if a file appears several times)
+    """
+
+    path = str(Path(manual_thresholds).resolve())
+    if not os.path.exists(path):
+        return {}
+
+    mtime = os.stat(path).st_mtime_ns
+
+    with _MANUAL_THRESHOLDS_LOCK:
+
+        if path in _MANUAL_THRESHOLDS and _MANUAL_THRESHOLDS[path][0] == mtime:
+            return _MANUAL_THRESHOLDS[path][1]
+
+        manual_df = pd.read_csv(path).drop_duplicates(subset="file", keep="first")
+        manual_dict = dict(zip(manual_df["file"], manual_df["threshold"]))
+
+        _MANUAL_THRESHOLDS[path] = (mtime, manual_dict)
+
+    return manual_dict
+
+
+def record_threshold(manual_thresholds: str | Path, name: str, threshold: float) -> None:
+    """
+    Add or replace the threshold of a file in the manual thresholds file (created if it does not exist)
+
+    The file is locked while it is read and replaced, so workers of other processes never drop each other's thresholds
+
+    Parameters
+    ----------
+    manual_thresholds : str | Path
+        Path to file containing manual threshold (columns ``file`` and ``threshold``)
+    name : str
+        File name
+    threshold : float
+        RMS threshold
+
+    Returns
+    -------
+    None
+    """
+
+    manual_thresholds = Path(manual_thresholds)
+
+    with lock_file(manual_thresholds):
+
+        if manual_thresholds.exists():
+            manual_df = pd.read_csv(manual_thresholds)
+            manual_df = manual_df[manual_df["file"] != name]
+        else:
+            manual_df = pd.DataFrame({"file": [], "threshold": []})
+
+        manual_df = pd.concat([manual_df, pd.DataFrame({"file": [name], "threshold": [threshold]})],
+                              ignore_index=True)
+
+        # Replace the file at once so readers never see it half written
+        temp_file = manual_thresholds.parent / f"{manual_thresholds.name}.{os.getpid()}.tmp"
+        manual_df.to_csv(temp_file, index=False)
+        os.replace(temp_file, manual_thresholds)
+
+
+@fill_doc
+def record_quality(error_log: str | Path, name: str, n_ipus: int, quality_ok: bool) -> None:
+    """
+    Record the quality check of a file for the error log
+
+    Each worker (process and thread) appends to its own shard next to ``error_log`` so that parallel workers never
+    write to the same file, the shards are merged into ``error_log`` by ``merge_quality_log``
+
+    Parameters
+    ----------
+    %(error_log)s
+    name : str
+        Name of the file
+    n_ipus : int
+        Number of IPUs found
+    quality_ok : bool
+        ``True`` if the quality check passed
+
+    Returns
+    -------
+    None
+    """
+
+    error_log = Path(error_log)
+    os.makedirs(error_log.parent, exist_ok=True)
+
+    shard = error_log.parent / f"{error_log.name}.{os.getpid()}-{threading.get_ident()}{QUALITY_SHARD_SUFFIX}"
+    with open(shard, "a") as f:
+        f.write(f"{name},{n_ipus},{quality_ok}\n")
+
+
+@fill_doc
+def merge_quality_log(error_log: str | Path) -> pd.DataFrame:
+    """
+    Merge the shards written by ``record_quality`` into ``error_log`` (keeping records already in it)
+
+    This must be called by a single writer once all workers are done, e.g. at the end of the run
+
+    Parameters
+    ----------
+    %(error_log)s
+
+    Returns
+    -------
+    quality_df : pd.DataFrame
+        Number of IPUs (``n_ipus``) and quality check (``ok``) of each file (``name``)
+    """
+
+    error_log = Path(error_log)
+    shards = sorted(error_log.parent.glob(f"{glob.escape(error_log.name)}.*{QUALITY_SHARD_SUFFIX}"))
+
+    lines = []
+    for path in ([error_log] if error_log.exists() else []) + shards:
+        with open(path, "r") as f:
+            lines.extend(line for line in f.read().splitlines() if line and line != QUALITY_HEADER)
+
+    # Write the whole table (with header) at once, then remove the shards
+    temp_log = error_log.parent / f"{error_log.name}.tmp"
+    with open(temp_log, "w") as f:
+        f.write("\n".join([QUALITY_HEADER] + lines) + "\n")
+    os.replace(temp_log, error_log)
+
+    for shard in shards:
+        os.remove(shard)
+
+    return pd.read_csv(error_log)
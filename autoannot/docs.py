@@ -61,9 +61,15 @@ DOC_DICT["log_file"] = "log_file : None | str | Path\n\t\tPath to the log file"
 #                                 "if None, it is ignored")
 # DOC_DICT["max_speakers"] = ("max_speakers : None | int\n\t\tMaximum number of speakers in the file, if is unknown"
 #                            " ``None`` is specified")
+DOC_DICT["max_batch_samples"] = ("max_batch_samples : None | int\n\t\tMaximum number of samples in a padded batch, if "
+                                 "``None`` the default is used")
+DOC_DICT["max_corpus_samples"] = ("max_corpus_samples : None | int\n\t\tMaximum number of IPU samples of the files "
+                                  "transcribed together (held in memory at once), if ``None`` the default is used")
 DOC_DICT["min_duration"] = "min_duration : float\n\t\tMinimum duration of the interval, default is ```0.0``"
 # DOC_DICT["min_sil"] = "min_sil : None | float\n\t\tMinimum silence duration"
 # DOC_DICT["min_ipu"] = "min_ipu : None | float\n\t\tMinimum IPU duration"
+DOC_DICT["min_ipu_duration"] = ("min_duration : float\n\t\tIPUs shorter than it (in seconds) are not sent to the "
+                                "model and left empty")
 DOC_DICT["min_mean_duration"] = "min_mean_duration : None | float\n\t\tMinimum mean duration"
 # DOC_DICT["min_n_ipus"] = "min_n_ipus : None | min_n_ipus\n\t\tMinimum number of IPUs"
 DOC_DICT["model"] = "model : str\n\t\tName of the model to use"
@@ -83,6 +89,8 @@ DOC_DICT["pyannote_file"] = "pyannote_file : str | Path\n\t\tPath to Pyannote di
 # Q
 
 # R
+DOC_DICT["min_rms"] = ("min_rms : float\n\t\tIPUs whose RMS (audio between ``-1`` and ``1``) is lower are not sent to "
+                       "the model and left empty")
 # DOC_DICT["rms"] = "rms : None | float\n\t\tRMS"
 
 # S
@@ -98,6 +106,8 @@ DOC_DICT["target"] = "target : None | str\n\t\t"
 DOC_DICT["trs_file"] = "trs_file : str | Path\n\t\tPath to transcription file"
 DOC_DICT["temp_file"] = "temp_file : \n\t\t"
 DOC_DICT["text"] = "text : str\n\t\tText to be cleaned"
+DOC_DICT["threshold_search"] = ("threshold_search : bool\n\t\tIf ``True``, search a threshold passing the quality check "
+                                "when the first one fails, and record it in ``manual_thresholds`` (if set)")
 DOC_DICT["tier_name"] = "tier_name : str\n\t\tName of the tier for annotation file"
 DOC_DICT["timestamp"] = "timestamp : float\n\t\t"
 DOC_DICT["transcription"] = "transcription : \n\t\t"
@@ -0,0 +1,55 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from autoannot.docs import fill_doc
+from autoannot.utils.audio import get_segment
+
+logger = logging.getLogger(__name__)
+
+
+@fill_doc
+def filter_ipus(data: np.ndarray, sample_rate: int, ipu_df: pd.DataFrame, min_duration: float = 0.0,
+                min_rms: float = 0.0) -> np.ndarray:
+    """
+    Find the IPUs worth sending to the model, i.e. long and loud enough (not clicks or breaths)
+
+    IPUs that are filtered out are left empty, they get the ``empty`` placeholder when the transcription is cleaned
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Audio, e.g. opened with ``open_audio`` (only the IPUs are read)
+    %(sample_rate)s
+    ipu_df : pd.DataFrame
+        Rows of the IPUs in the diarization
+    min_duration : float
+        Minimum duration of an IPU in seconds
+    min_rms : float
+        Minimum RMS of an IPU (audio between ``-1`` and ``1``)
+
+    Returns
+    -------
+    keep : np.ndarray
+        ``True`` for the IPUs to transcribe
+    """
+
+    start = ipu_df["start"].to_numpy(dtype=float)
+    end = ipu_df["end"].to_numpy(dtype=float)
+
+    keep = end - start >= min_duration
+
+    if min_rms > 0:
+
+        # RMS of each IPU, reading only the IPUs that are long enough
+        rms = np.zeros(len(keep))
+        for i in np.flatnonzero(keep):
+            segment = get_segment(data, sample_rate, start[i], end[i])
+            rms[i] = np.sqrt(np.mean(np.square(segment, dtype=np.float64))) if len(segment) else 0.0
+
+        keep &= rms >= min_rms
+
+    logger.info(f"{(~keep).sum()} of {len(keep)} IPUs skipped (model calls saved)")
+
+    return keep
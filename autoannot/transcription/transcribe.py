@@ -1,8 +1,10 @@
+import os
 from pathlib import Path
-from typing import Dict
+import traceback
+from typing import Dict, List
 
 from .transcribe_whisper import transcribe_whisper
-from .transcribe_w2v2 import transcribe_wav2vec2
+from .transcribe_w2v2 import group_files, transcribe_wav2vec2, transcribe_wav2vec2_corpus
 from .clean_transcription import clean_transcription
 from autoannot.docs import fill_doc
 
@@ -26,14 +28,118 @@ def transcribe(in_file: str | Path, out_file: str | Path, dia_file: str | Path,
 
     backend = params["transcription"]["backend"]
 
+    # Limits under which IPUs are not sent to the model (shared by all backends)
+    ipu_filter = params["transcription"].get("filter", {})
+
     if backend == "whisper":
-        df = transcribe_whisper(in_file, dia_file, **params["transcription"]["whisper"])
+        df = transcribe_whisper(in_file, dia_file, **params["transcription"]["whisper"], **ipu_filter)
 
     elif backend == "wav2vec2":
-        df = transcribe_wav2vec2(in_file, dia_file, **params["transcription"]["wav2vec2"])
+        df = transcribe_wav2vec2(in_file, dia_file, **params["transcription"]["wav2vec2"], **ipu_filter)
     else:
         raise NotImplementedError(f"Backend '{backend}' is not implemented")
 
     df = clean_transcription(df, empty=params["transcription"]["empty"])
 
     df.to_csv(out_file, index=False)
+
+
+@fill_doc
+def transcribe_corpus(in_files: List[str | Path], out_files: List[str | Path], dia_files: List[str | Path],
+                      params: Dict) -> Dict[str, List[str]]:
+    """
+    Transcribe many files, writing the same output files as ``transcribe``
+
+    With the ``\"wav2vec2\"`` backend the IPUs of consecutive files are transcribed in shared batches (see
+    ``group_files``), other backends transcribe one file at a time. A failure only affects its own file: the files of
+    a group that fails are transcribed again one by one
+
+    Parameters
+    ----------
+    in_files : List[str | Path]
+        Paths to input files
+    out_files : List[str | Path]
+        Paths to output files
+    dia_files : List[str | Path]
+        Paths to diarization files
+    %(params)s
+
+    Returns
+    -------
+    errors : Dict[str, List[str]]
+        Name of the files (``file``) that failed with their traceback (``error``), a group of files has the names of
+        all of its files
+    """
+
+    errors = {"file": [], "error": []}
+
+    # One file per group unless wav2vec2 can share its batches
+    if params["transcription"]["backend"] == "wav2vec2":
+        groups = group_files(dia_files, params["transcription"]["wav2vec2"].get("max_corpus_samples"))
+    else:
+        groups = [[i] for i in range(len(in_files))]
+
+    for group in groups:
+
+        try:
+            _transcribe_group([in_files[i] for i in group], [out_files[i] for i in group],
+                              [dia_files[i] for i in group], params)
+            continue
+
+        except Exception:  # noqa
+            errors["file"].append(", ".join(os.path.basename(in_files[i]) for i in group))
+            errors["error"].append(traceback.format_exc())
+
+        if len(group) == 1:
+            continue
+
+        # Find out which files of the group fail
+        for i in group:
+
+            try:
+                transcribe(in_files[i], out_files[i], dia_files[i], params)
+
+            except Exception:  # noqa
+                errors["file"].append(os.path.basename(in_files[i]))
+                errors["error"].append(traceback.format_exc())
+
+    return errors
+
+
+########################################################################################################################
+# Private methods                                                                                                      #
+########################################################################################################################
+
+
+@fill_doc
+def _transcribe_group(in_files: List[str | Path], out_files: List[str | Path], dia_files: List[str | Path],
+                      params: Dict) -> None:
+    """
+    Transcribe a group of files, in shared batches with the ``\"wav2vec2\"`` backend
+
+    Parameters
+    ----------
+    in_files : List[str | Path]
+        Paths to input files
+    out_files : List[str | Path]
+        Paths to output files
+    dia_files : List[str | Path]
+        Paths to diarization files
+    %(params)s
+
+    Returns
+    -------
+    None
+    """
+
+    if params["transcription"]["backend"] != "wav2vec2":
+        for in_file, out_file, dia_file in zip(in_files, out_files, dia_files):
+            transcribe(in_file, out_file, dia_file, params)
+        return
+
+    df_list = transcribe_wav2vec2_corpus(in_files, dia_files, **params["transcription"]["wav2vec2"],
+                                         **params["transcription"].get("filter", {}))
+
+    for df, out_file in zip(df_list, out_files):
+        df = clean_transcription(df, empty=params["transcription"]["empty"])
+        df.to_csv(out_file, index=False)
@@ -1,81 +1,302 @@
+from functools import partial
 from pathlib import Path
 from typing import List, Tuple
 
-import librosa
 import numpy as np
 import pandas as pd
 import torch
 from transformers import Wav2Vec2ForCTC, AutoProcessor
 
 from autoannot.docs import fill_doc
+from autoannot.transcription.filter_ipus import filter_ipus
+from autoannot.utils.audio import get_segment, open_audio
+from autoannot.utils.models import get_device, get_model
 
 SR_RATE = 16_000
+LANG = "fra"
+MAX_BATCH_SAMPLES = 100 * SR_RATE  # padded samples per batch
+MAX_CORPUS_SAMPLES = 3600 * SR_RATE  # IPU samples of the files held in memory at once (about 230 MB)
 
 
 @fill_doc
-def transcribe_wav2vec2(in_file: str | Path, dia_file: str | Path,
-                        model: str, use_cuda: bool) -> pd.DataFrame:
+def transcribe_wav2vec2(in_file: str | Path, dia_file: str | Path, model: str, use_cuda: bool,
+                        max_batch_samples: None | int = None, max_corpus_samples: None | int = None,
+                        min_duration: float = 0.0, min_rms: float = 0.0) -> pd.DataFrame:
     """
     Transcribe with Wav2vec2
 
     Parameters
     ----------
-    %(in_file)
+    %(in_file)s
     %(dia_file)s
     %(model)s
     %(use_cuda)s
+    %(max_batch_samples)s
+    %(max_corpus_samples)s
+    %(min_ipu_duration)s
+    %(min_rms)s
 
     Returns
     -------
     %(df)s
     """
 
-    data_list, dia_df = _make_cropped(in_file, dia_file)
+    return transcribe_wav2vec2_corpus([in_file], [dia_file], model, use_cuda, max_batch_samples=max_batch_samples,
+                                      max_corpus_samples=max_corpus_samples, min_duration=min_duration,
+                                      min_rms=min_rms)[0]
+
+
+@fill_doc
+def transcribe_wav2vec2_corpus(in_files: List[str | Path], dia_files: List[str | Path], model: str, use_cuda: bool,
+                               max_batch_samples: None | int = None, max_corpus_samples: None | int = None,
+                               min_duration: float = 0.0, min_rms: float = 0.0) -> List[pd.DataFrame]:
+    """
+    Transcribe many files with Wav2vec2, IPUs of consecutive files sharing the same batches
+
+    Files with few IPUs would leave batches underfilled on their own, pooling them keeps the batches full. Files are
+    pooled in groups (see ``group_files``) so only the IPUs of one group are in memory at once
+
+    Parameters
+    ----------
+    in_files : List[str | Path]
+        Paths to input files
+    dia_files : List[str | Path]
+        Paths to diarization files
+    %(model)s
+    %(use_cuda)s
+    %(max_batch_samples)s
+    %(max_corpus_samples)s
+    %(min_ipu_duration)s
+    %(min_rms)s
+
+    Returns
+    -------
+    df_list : List[pd.DataFrame]
+        Transcription of each file (same as ``transcribe_wav2vec2``)
+    """
+
+    # Load model (once per process)
+    device = get_device(use_cuda)
+    processor, model = get_model("wav2vec2", model, device, loader=partial(_load_model, model, device, LANG),
+                                 adapter=LANG)
+
+    df_list = []
+    for group in group_files(dia_files, max_corpus_samples):
+
+        data_list, dia_list, is_ipu_list = [], [], []
+        for i in group:
+            file_data_list, dia_df, is_ipu = _make_cropped(in_files[i], dia_files[i], min_duration=min_duration,
+                                                           min_rms=min_rms)
+            data_list.extend(file_data_list)
+            dia_list.append(dia_df)
+            is_ipu_list.append(is_ipu)
+
+        transcriptions = _transcribe_batches(data_list, processor, model, device, max_batch_samples)
+
+        # IPUs are in the same order as the files and as in their diarization file
+        offset = 0
+        for dia_df, is_ipu in zip(dia_list, is_ipu_list):
+            df_list.append(_to_df(dia_df, is_ipu, transcriptions[offset: offset + is_ipu.sum()]))
+            offset += is_ipu.sum()
+
+    return df_list
+
+
+@fill_doc
+def group_files(dia_files: List[str | Path], max_corpus_samples: None | int = None) -> List[List[int]]:
+    """
+    Group consecutive files whose IPUs fit in ``max_corpus_samples`` once cropped (only the diarizations are read)
+
+    Parameters
+    ----------
+    dia_files : List[str | Path]
+        Paths to diarization files
+    %(max_corpus_samples)s
+
+    Returns
+    -------
+    groups : List[List[int]]
+        Indices of the files of each group (a file with more samples than ``max_corpus_samples`` or whose diarization
+        cannot be read is alone in its group, so that it fails on its own)
+    """
+
+    if max_corpus_samples is None:
+        max_corpus_samples = MAX_CORPUS_SAMPLES
+
+    groups = []
+    current = np.inf
+    for i, dia_file in enumerate(dia_files):
+
+        try:
+            df = pd.read_csv(dia_file)
+            ipu_rows = df[df["annotation"] != "#"]
+            n_samples = int(((ipu_rows["end"] - ipu_rows["start"]) * SR_RATE).sum())
+
+        except Exception:  # noqa
+            n_samples = max_corpus_samples + 1
+
+        if current + n_samples > max_corpus_samples:
+            groups.append([i])
+            current = n_samples
+        else:
+            groups[-1].append(i)
+            current += n_samples
+
+    return groups
+
+
+@fill_doc
+def _load_model(model: str, device: str, lang: str) -> Tuple[AutoProcessor, Wav2Vec2ForCTC]:
+    """
+    Load the processor and the model with the adapter for ``lang``
+
+    Parameters
+    ----------
+    %(model)s
+    device : str
+        Device to load the model on
+    lang : str
+        Language of the adapter
+
+    Returns
+    -------
+    processor : AutoProcessor
+        Processor
+    model : Wav2Vec2ForCTC
+        Model
+    """
 
-    # Load model
     processor = AutoProcessor.from_pretrained(model)
     model = Wav2Vec2ForCTC.from_pretrained(model)
 
-    processor.tokenizer.set_target_lang("fra")
-    model.load_adapter("fra")
+    processor.tokenizer.set_target_lang(lang)
+    model.load_adapter(lang)
+    model.to(device)
+
+    return processor, model
+
+
+@fill_doc
+def _transcribe_batches(data_list: List[np.ndarray], processor: AutoProcessor, model: Wav2Vec2ForCTC, device: str,
+                        max_batch_samples: None | int = None) -> List[str]:
+    """
+    Transcribe IPUs in padded batches of similar length
+
+    IPUs are sorted by length and grouped until the padded batch exceeds ``max_batch_samples``. Logits of each IPU are
+    truncated to its own length before decoding, so padding does not change the transcription.
+
+    Parameters
+    ----------
+    %(data_list)s
+    processor : AutoProcessor
+        Processor
+    model : Wav2Vec2ForCTC
+        Model
+    device : str
+        Device the model is loaded on
+    %(max_batch_samples)s
+
+    Returns
+    -------
+    transcriptions : List[str]
+        Transcription of each IPU (``\"\"`` if it is too short for the model)
+    """
+
+    if max_batch_samples is None:
+        max_batch_samples = MAX_BATCH_SAMPLES
+
+    # Without layer norm in the feature encoder, padding changes the features (one IPU per batch)
+    if model.config.feat_extract_norm != "layer":
+        max_batch_samples = 0
+
+    lengths = np.array([len(data) for data in data_list], dtype=int)
+    transcriptions = [""] * len(data_list)
+
+    # Number of frames of the logits, IPUs shorter than the receptive field of the feature encoder have none
+    n_frames = model._get_feat_extract_output_lengths(torch.as_tensor(lengths)).cpu().numpy()
+
+    # Longest first, so the first IPU of a batch sets its padded length
+    order = [i for i in np.argsort(-lengths, kind="stable") if n_frames[i] > 0]
+
+    for batch in _get_batches(order, lengths, max_batch_samples):
+
+        inputs = processor([data_list[i] for i in batch], sampling_rate=SR_RATE, padding=True,
+                           return_attention_mask=True, return_tensors="pt").to(device)
+
+        with torch.no_grad():
+            ids = torch.argmax(model(**inputs).logits, dim=-1).cpu()
 
-    idx = 0
-    df = {"tier": [], "start": [], "end": [], "annotation": []}
-    for _, row in dia_df.iterrows():
+        texts = processor.batch_decode([ids[k, :n_frames[i]] for k, i in enumerate(batch)])
 
-        if row["annotation"] == "#":
-            transcription = "#"
+        for i, text in zip(batch, texts):
+            transcriptions[i] = text
 
+    return transcriptions
+
+
+def _get_batches(order: List[int], lengths: np.ndarray, max_batch_samples: int) -> List[List[int]]:
+    """
+    Group IPUs sorted by decreasing length into batches whose padded size is at most ``max_batch_samples``
+
+    Parameters
+    ----------
+    order : List[int]
+        Indices of the IPUs sorted by decreasing length
+    lengths : np.ndarray
+        Number of samples of each IPU
+    max_batch_samples : int
+        Maximum number of samples of a padded batch (an IPU longer than it is alone in its batch)
+
+    Returns
+    -------
+    batches : List[List[int]]
+        Indices of the IPUs of each batch
+    """
+
+    batches = []
+    for i in order:
+
+        # The padded length of a batch is the length of its first IPU
+        if batches and (len(batches[-1]) + 1) * lengths[batches[-1][0]] <= max_batch_samples:
+            batches[-1].append(i)
         else:
+            batches.append([i])
 
-            inputs = processor(data_list[idx], sampling_rate=SR_RATE, return_tensors="pt")
+    return batches
 
-            with torch.no_grad():
-                try:
-                    outputs = model(**inputs).logits
 
-                    ids = torch.argmax(outputs, dim=-1)[0]
-                    transcription = processor.decode(ids)
-                    print(transcription)
-                    idx += 1
+@fill_doc
+def _to_df(dia_df: pd.DataFrame, is_ipu: np.ndarray, transcriptions: List[str]) -> pd.DataFrame:
+    """
+    Make the transcription tier from the diarization
 
-                # RuntimeError: Calculated padded input size per channel: (1). Kernel size: (2).
-                # Kernel size can't be greater than actual input size
-                except RuntimeError:
-                    transcription = ""
+    Parameters
+    ----------
+    %(dia_df)s
+    is_ipu : np.ndarray
+        ``True`` for the IPUs of the diarization that have been transcribed (the others are left empty)
+    transcriptions : List[str]
+        Transcription of each IPU
 
-        df["tier"].append("transcription")
-        df["start"].append(row["start"])
-        df["end"].append(row["end"])
-        df["annotation"].append(transcription)
+    Returns
+    -------
+    %(df)s
+    """
+
+    annotation = np.where(dia_df["annotation"] == "#", "#", "").astype(object)
+    annotation[is_ipu] = transcriptions
 
-    df = pd.DataFrame(df)
+    df = pd.DataFrame({"tier": "transcription",
+                       "start": dia_df["start"].to_numpy(),
+                       "end": dia_df["end"].to_numpy(),
+                       "annotation": annotation})
 
     return df
 
 
 @fill_doc
-def _make_cropped(audio_file: str | Path, dia_file: str | Path) -> Tuple[List[np.ndarray], pd.DataFrame]:
+def _make_cropped(audio_file: str | Path, dia_file: str | Path, min_duration: float = 0.0,
+                  min_rms: float = 0.0) -> Tuple[List[np.ndarray], pd.DataFrame, np.ndarray]:
     """
     Make a cropped version of the autio file
 
@@ -83,27 +304,30 @@ def _make_cropped(audio_file: str | Path, dia_file: str | Path) -> Tuple[List[np
     ----------
     %(audio_file)s
     %(dia_file)s
+    %(min_ipu_duration)s
+    %(min_rms)s
 
     Returns
     -------
     %(data_list)s
     %(df)s
+    is_ipu : np.ndarray
+        ``True`` for the IPUs of the diarization in ``data_list``
     """
 
-    data, sr = librosa.load(audio_file, sr=SR_RATE)
-    if data.shape[0] == 2:  # stereo data
-        data = data.mean(axis=0).astype(np.float32)
+    # Audio is only opened, IPUs are read (downmixed and resampled) one by one
+    data, sr = open_audio(audio_file, SR_RATE)
 
     df = pd.read_csv(dia_file)
 
-    data_list = []
-    for _, row in df.iterrows():
+    # IPUs too short or too quiet are left empty
+    ipu_rows = df[df["annotation"] != "#"]
+    ipu_rows = ipu_rows[filter_ipus(data, sr, ipu_rows, min_duration=min_duration, min_rms=min_rms)]
 
-        if row["annotation"] == "#":
-            continue
+    data_list = []
+    for _, row in ipu_rows.iterrows():
 
         # Get a segment of the audio
-        start, end = int(row["start"] * sr), int(row["end"] * sr)
-        data_list.append(data[start:end])
+        data_list.append(get_segment(data, sr, row["start"], row["end"], SR_RATE))
 
-    return data_list, df
+    return data_list, df, df.index.isin(ipu_rows.index)
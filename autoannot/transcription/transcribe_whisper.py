@@ -1,24 +1,38 @@
+from functools import partial
 from pathlib import Path
-import tempfile
-from typing import Tuple
+from typing import Dict, List, Tuple
 import warnings
 
 import numpy as np
-from scipy.io import wavfile
 import pandas as pd
-import torch
 import whisper
+from whisper.audio import CHUNK_LENGTH, SAMPLE_RATE
 import whisper_timestamped
 
 from autoannot.docs import fill_doc
+from autoannot.transcription.filter_ipus import filter_ipus
+from autoannot.utils.audio import get_segment, open_audio
+from autoannot.utils.models import get_device, get_model
+
+# Silence between two IPUs packed in the same window (seconds)
+SEPARATOR_DURATION = 0.5
+
+# Confidence under which IPUs are decoded again by the cascade model (same defaults as Whisper)
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+PROMPT = "Bon. Ben je crois euh je vois ce que euh tu veux dire"
 
 # UserWarning: FP16 is not supported on CPU; using FP32 instead
 warnings.filterwarnings(action="ignore", category=UserWarning)
 
 
 @fill_doc
-def transcribe_whisper(in_file: str | Path, dia_file: str | Path,
-                       model: str, use_cuda: bool, condition_on_previous_text: bool = False) -> pd.DataFrame:
+def transcribe_whisper(in_file: str | Path, dia_file: str | Path, model: str, use_cuda: bool,
+                       condition_on_previous_text: bool = False, packing: bool = False,
+                       cascade_model: None | str = None, logprob_threshold: float = LOGPROB_THRESHOLD,
+                       no_speech_threshold: float = NO_SPEECH_THRESHOLD, min_duration: float = 0.0,
+                       min_rms: float = 0.0) -> pd.DataFrame:
     """
 
     Parameters
@@ -29,43 +43,61 @@ def transcribe_whisper(in_file: str | Path, dia_file: str | Path,
     %(use_cuda)s
     condition_on_previous_text : bool
         if ``True``, use previous information
+    packing : bool
+        if ``True``, pack IPUs into windows of at most 30 seconds separated by silences, each decoded in a single pass.
+        Otherwise all IPUs are concatenated into a single audio
+    cascade_model : None | str
+        Name of a larger model decoding again the IPUs transcribed with low confidence by ``model``, if ``None`` there
+        is no second pass
+    logprob_threshold : float
+        IPUs with a segment whose average log probability is below it are decoded again by ``cascade_model``
+    no_speech_threshold : float
+        IPUs with a segment whose no speech probability is above it are decoded again by ``cascade_model``
+    %(min_ipu_duration)s
+    %(min_rms)s
     Returns
     -------
     %(df)s
     """
 
-    # Make cropped audio file
-    temp_audio, ipu_df, dia_df = _make_cropped(in_file, dia_file)
+    window_params = {"window_duration": CHUNK_LENGTH, "separator": SEPARATOR_DURATION} if packing else {}
+    device = get_device(use_cuda)
 
-    # Load model
-    model = whisper.load_model(model)
+    # Read files (audio only opened, IPUs are read when they are cropped)
+    data, sample_rate, dia_df = _read_files(in_file, dia_file)
+    ipu_rows = dia_df[dia_df["annotation"] == "ipu"]
 
-    # Use CUDA
-    if torch.cuda.is_available() and use_cuda:
-        model.to(torch.device("cuda"))
+    # IPUs too short or too quiet are left empty
+    ipu_rows = ipu_rows[filter_ipus(data, sample_rate, ipu_rows, min_duration=min_duration, min_rms=min_rms)]
 
-    # Prompt
-    prompt = "Bon. Ben je crois euh je vois ce que euh tu veux dire"
+    # Transcribe all IPUs
+    windows, ipu_df = _make_cropped(data, sample_rate, ipu_rows, **window_params)
+    results = _transcribe(model, device, windows, condition_on_previous_text)
+    words = _get_words(results, ipu_df)
 
-    # Transcribe
-    results = whisper_timestamped.transcribe(model, initial_prompt=prompt,
-                                             condition_on_previous_text=condition_on_previous_text,
-                                             audio=temp_audio.name)  # noqa
+    # Decode again the IPUs with low confidence with the larger model
+    if cascade_model is not None:
 
-    # Convert to standard format and save
-    results = _convert_to_dataframe(results, ipu_df, dia_df)
+        low = (words["avg_logprob"] < logprob_threshold) | (words["no_speech_prob"] > no_speech_threshold)
+        low_ipus = np.unique(words.loc[low, "index"])
+
+        if len(low_ipus) > 0:
+            windows, ipu_df = _make_cropped(data, sample_rate, ipu_rows.loc[low_ipus], **window_params)
+            results = _transcribe(cascade_model, device, windows, condition_on_previous_text)
 
-    # Clean up
-    temp_audio.close()
+            words = pd.concat([words[~words["index"].isin(low_ipus)], _get_words(results, ipu_df)])
+            words = words.sort_values("index", kind="stable")
+
+    # Convert to standard format and save
+    results = _convert_to_dataframe(words, dia_df)
 
     return results
 
 
 @fill_doc
-def _make_cropped(audio_file: str | Path,
-                  dia_file: str | Path) -> Tuple[tempfile.NamedTemporaryFile, pd.DataFrame, pd.DataFrame]:
+def _read_files(audio_file: str | Path, dia_file: str | Path) -> Tuple[np.ndarray, int, pd.DataFrame]:
     """
-    Make cropped version of the audio
+    Open the audio and read the diarization
 
     Parameters
     ----------
@@ -74,153 +106,262 @@ def _make_cropped(audio_file: str | Path,
 
     Returns
     -------
-    %(temp_file)s
-    %(ipu_df)s
+    data : np.ndarray
+        Audio opened with ``open_audio`` (not loaded in memory)
+    %(sample_rate)s
     %(df)s
     """
 
-    # Read files
-    sr, data = wavfile.read(audio_file)
-    if data.shape[0] == 2:  # stereo data
-        data = data.mean(axis=0)
+    data, sample_rate = open_audio(audio_file, SAMPLE_RATE)
 
     df = pd.read_csv(dia_file)
 
-    data_list = []
-    ipu_df = {"start": [], "end": [], "index": []}
-    current_start = 0.0
-    for idx, row in df.iterrows():
+    return data, sample_rate, df
+
+
+@fill_doc
+def _make_cropped(data: np.ndarray, sample_rate: int, ipu_rows: pd.DataFrame, window_duration: None | float = None,
+                  separator: float = 0.0) -> Tuple[List[np.ndarray], pd.DataFrame]:
+    """
+    Make cropped version of the audio
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Audio opened with ``open_audio``
+    %(sample_rate)s
+    ipu_rows : pd.DataFrame
+        Rows of the IPUs in the diarization
+    window_duration : None | float
+        Maximum duration of a window in seconds (an IPU longer than it is alone in its window), if ``None`` all IPUs
+        are in the same window
+    separator : float
+        Duration of the silence between two IPUs of a window in seconds
+
+    Returns
+    -------
+    windows : List[np.ndarray]
+        Mono float32 audio of the IPUs of each window at the sample rate of Whisper (16 kHz), so it does not call
+        ffmpeg
+    ipu_df : pd.DataFrame
+        Start and end of each IPU in its window, with its index in the diarization
+    """
+
+    sr = SAMPLE_RATE
+
+    durations = (ipu_rows["end"] - ipu_rows["start"]).to_numpy()
+
+    if window_duration is None:
+        window = np.zeros(len(ipu_rows), dtype=int)
+    else:
+        window = _pack_ipus(durations, window_duration, separator)
+
+    silence = np.zeros(int(separator * sr), dtype=np.float32)
+
+    windows = []
+    ipu_df = {"start": [], "end": [], "index": [], "window": []}
+    for w in range(window.max() + 1 if len(window) else 0):
 
-        duration = row["end"] - row["start"]
-        if row["annotation"] == "ipu":
+        data_list = []
+        current_start = 0.0
+        for idx, row in ipu_rows[window == w].iterrows():
 
-            # Get a segment of the audio
-            start, end = int(row["start"] * sr), int(row["end"] * sr)
-            data_list.append(data[start:end])
+            # Separate from the previous IPU
+            if data_list:
+                data_list.append(silence)
+                current_start += len(silence) / sr
 
-            # Note the total offset and regions where this offset is valid
+            duration = row["end"] - row["start"]
+
+            # Get a segment of the audio (only this segment is read and resampled)
+            data_list.append(get_segment(data, sample_rate, row["start"], row["end"], sr))
+
+            # Note the offset in the window and regions where this offset is valid
             ipu_df["start"].append(current_start)
             ipu_df["end"].append(current_start + duration)
             ipu_df["index"].append(idx)
+            ipu_df["window"].append(w)
 
-            # Update current start point in the new audio
+            # Update current start point in the window
             current_start += duration
 
-    # Concatenate data
-    data = np.concatenate(data_list)
+        # Concatenate data
+        windows.append(np.concatenate(data_list).astype(np.float32))
 
     ipu_df = pd.DataFrame(ipu_df)
 
-    temp_file = tempfile.NamedTemporaryFile(delete=False)
-    wavfile.write(temp_file, sr, data)
+    return windows, ipu_df
+
+
+def _pack_ipus(durations: np.ndarray, window_duration: float, separator: float) -> np.ndarray:
+    """
+    Pack consecutive IPUs into windows of at most ``window_duration`` seconds, keeping their order
+
+    Parameters
+    ----------
+    durations : np.ndarray
+        Duration of each IPU
+    window_duration : float
+        Maximum duration of a window in seconds (an IPU longer than it is alone in its window)
+    separator : float
+        Duration of the silence between two IPUs of a window in seconds
+
+    Returns
+    -------
+    window : np.ndarray
+        Window of each IPU
+    """
+
+    window = np.empty(len(durations), dtype=int)
 
-    return temp_file, ipu_df, df
+    w, current = -1, np.inf
+    for i, duration in enumerate(durations):
+
+        if current + separator + duration > window_duration:
+            w, current = w + 1, duration
+        else:
+            current += separator + duration
+
+        window[i] = w
+
+    return window
 
 
 @fill_doc
-def _convert_to_dataframe(transcription, ipu_df: pd.DataFrame, dia_df: pd.DataFrame,
-                          partial_overlap: str = "ignore") -> pd.DataFrame:
+def _transcribe(model: str, device: str, windows: List[np.ndarray], condition_on_previous_text: bool) -> List[Dict]:
     """
-    Convert the output to DataFrame
+    Transcribe each window
 
     Parameters
     ----------
-    %(transcription)s
-    %(ipu_df)s
-    %(dia_df)s
-    %(partial_overlap)s
+    %(model)s
+    device : str
+        Device to load the model on
+    windows : List[np.ndarray]
+        Mono float32 audio of each window
+    condition_on_previous_text : bool
+        if ``True``, use previous information
 
     Returns
     -------
-    %(df)s
+    transcriptions : List[Dict]
+        Transcription of each window
     """
 
-    # Assign IPU index to each word
-    annotation = {"annotation": [], "index": []}
-    for segment in transcription["segments"]:
+    # Load model (once per process)
+    model = get_model("whisper", model, device, loader=partial(whisper.load_model, model, device=device))
 
-        for word in segment["words"]:
+    # Transcribe (whisper_timestamped has no batch API, windows are decoded one after the other)
+    return [whisper_timestamped.transcribe(model, initial_prompt=PROMPT,
+                                           condition_on_previous_text=condition_on_previous_text,
+                                           audio=audio)  # noqa
+            for audio in windows]
 
-            start = _get_index(word["start"], ipu_df, start=True)
-            end = _get_index(word["end"], ipu_df, start=False)
 
-            # Start and end are not in the same interval
-            if start != end:
+@fill_doc
+def _get_words(transcriptions: List[Dict], ipu_df: pd.DataFrame, partial_overlap: str = "ignore") -> pd.DataFrame:
+    """
+    Assign each word to its IPU
 
-                if partial_overlap == "ignore":
-                    continue
-                else:
-                    raise NotImplementedError(f"'partial_overlap' == '{partial_overlap}' is not implemented")
+    Parameters
+    ----------
+    transcriptions : List[Dict]
+        Transcription of each window
+    ipu_df : pd.DataFrame
+        Start and end of each IPU in its window, with its index in the diarization
+    %(partial_overlap)s
 
-            annotation["annotation"].append(word["text"])
-            annotation["index"].append(start)
+    Returns
+    -------
+    words : pd.DataFrame
+        Text of each word (``text``) with its IPU (``index``), and the average log probability (``avg_logprob``) and
+        no speech probability (``no_speech_prob``) of its segment
+    """
 
-    annotation = pd.DataFrame(annotation)
+    # Assign IPU index to each word, with the offsets of its window
+    text, start, end, avg_logprob, no_speech_prob = [], [], [], [], []
+    for w, transcription in enumerate(transcriptions):
 
-    # Fall back on the diarization file
-    df = {"tier": [], "start": [], "end": [], "annotation": []}
-    for idx, row in dia_df.iterrows():
+        words = [(word, segment) for segment in transcription["segments"] for word in segment["words"]]
+        window_df = ipu_df[ipu_df["window"] == w]
 
-        if row["annotation"] == "ipu":
+        text.extend(word["text"] for word, _ in words)
+        start.append(_get_indices(np.array([word["start"] for word, _ in words], dtype=float), window_df, start=True))
+        end.append(_get_indices(np.array([word["end"] for word, _ in words], dtype=float), window_df, start=False))
+        avg_logprob.extend(segment.get("avg_logprob", 0.0) for _, segment in words)
+        no_speech_prob.extend(segment.get("no_speech_prob", 0.0) for _, segment in words)
 
-            # Extract text that corresponds to the IPU index
-            text = annotation[annotation["index"] == idx]["annotation"]
+    start = np.concatenate(start) if start else np.array([], dtype=int)
+    end = np.concatenate(end) if end else np.array([], dtype=int)
 
-            if len(text) == 0:
-                text = ""
+    words = pd.DataFrame({"index": start, "text": pd.Series(text, dtype=object),
+                          "avg_logprob": np.array(avg_logprob, dtype=float),
+                          "no_speech_prob": np.array(no_speech_prob, dtype=float)})
 
-            elif len(text) > 1:
-                text = text.to_list()
-                text = " ".join(text)
+    # Start and end are not in the same interval
+    same = start == end
+    if not same.all() and partial_overlap != "ignore":
+        raise NotImplementedError(f"'partial_overlap' == '{partial_overlap}' is not implemented")
 
-            else:
-                text = text.values[0]
+    return words[same].reset_index(drop=True)
 
-        else:
-            text = "#"
 
-        df["tier"].append("transcription")
-        df["start"].append(row["start"])
-        df["end"].append(row["end"])
-        df["annotation"].append(text)
+@fill_doc
+def _convert_to_dataframe(words: pd.DataFrame, dia_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the output to DataFrame
+
+    Parameters
+    ----------
+    words : pd.DataFrame
+        Text of each word (``text``) with its IPU (``index``), in order
+    %(dia_df)s
 
-    df = pd.DataFrame(df)
+    Returns
+    -------
+    %(df)s
+    """
+
+    # Join the words of each IPU (in order)
+    annotation = words.groupby("index", sort=False)["text"].agg(" ".join)
+
+    # Fall back on the diarization file
+    is_ipu = (dia_df["annotation"] == "ipu").to_numpy()
+    text = dia_df.index.to_series().map(annotation).fillna("").to_numpy(dtype=object)
+
+    df = pd.DataFrame({"tier": "transcription",
+                       "start": dia_df["start"].to_numpy(),
+                       "end": dia_df["end"].to_numpy(),
+                       "annotation": np.where(is_ipu, text, "#")})
     return df
 
 
 @fill_doc
-def _get_index(timestamp: float, df: pd.DataFrame, start: bool) -> int:
+def _get_indices(timestamps: np.ndarray, df: pd.DataFrame, start: bool) -> np.ndarray:
     """
+    Get the index of the IPU containing each timestamp
+
+    A timestamp on the boundary of two IPUs (or between them) belongs to the next one if it is a start and to the
+    previous one if it is an end. Timestamps beyond the last IPU belong to it.
 
     Parameters
     ----------
-    %(timestamp)s
+    timestamps : np.ndarray
+        Timestamps in the cropped audio
     %(df)s
     %(start)s
 
     Returns
     -------
-    %(index)s
+    indices : np.ndarray
+        Index of the IPU containing each timestamp
     """
 
-    # Beyond the last timestamp
-    last_timestamp = df["end"].values[-1]
-    if timestamp > last_timestamp:
-        return df["index"].values[-1]
-
-    df = df[(df["start"] <= timestamp) & (timestamp <= df["end"])]
-
-    # Sanity check (these should not happen)
-    if len(df) == 0:
-        raise ValueError(f"timestamp '{timestamp}' was not found anywhere in the IPU dataframe")
-
-    elif len(df) == 2:
-        if start:
-            return df["index"].values[1]
-        else:
-            return df["index"].values[0]
+    if start:  # first IPU ending after the timestamp
+        position = np.searchsorted(df["end"].to_numpy(), timestamps, side="right")
+    else:  # last IPU starting before the timestamp
+        position = np.searchsorted(df["start"].to_numpy(), timestamps, side="left") - 1
 
-    elif len(df) > 2:
-        raise ValueError(f"timestamp '{timestamp}' is in multiple IPUs")
+    position = np.clip(position, 0, len(df) - 1)
 
-    return df["index"].values[-1]
+    return df["index"].to_numpy()[position]
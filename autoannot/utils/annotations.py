@@ -1,11 +1,10 @@
 import os
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
+import numpy as np
 import pandas as pd
-from pyannote.audio import Pipeline  # noqa
 
-from ..diarization import PYANNOT_MODEL
 from autoannot.docs import fill_doc
 
 
@@ -13,7 +12,11 @@ from autoannot.docs import fill_doc
 def fill_missing(df: pd.DataFrame, target: None | str,
                  fill_symbol: str = "#", min_duration: float = 0.01) -> pd.DataFrame:
     """
-    TODO
+    Fill the gaps between the intervals of ``df`` with ``fill_symbol``
+
+    Rows whose annotation is ``target`` are dropped (unless ``target`` is ``None``) and a silence interval is inserted
+    wherever an interval starts more than ``min_duration`` after the end of the previous one (or after ``0.0``)
+
     Parameters
     ----------
     %(df)s
@@ -26,38 +29,80 @@ def fill_missing(df: pd.DataFrame, target: None | str,
     %(df)s
     """
 
-    result = {"tier": [], "start": [], "end": [], "annotation": []}
-    last_end = 0.0
+    if len(df[df["end"] < df["start"]]) > 0:
+        raise ValueError("end is before start")
 
-    for _, row in df.iterrows():
+    # Skip if specific target is set
+    if target is not None:
+        df = df[df["annotation"] != target]
 
-        # Skip if specific target is set
-        if not row["annotation"] != target and target is not None:
-            continue
+    tier = df["tier"].to_numpy()
+    start = df["start"].to_numpy(dtype=float)
+    end = df["end"].to_numpy(dtype=float)
+    annotation = df["annotation"].to_numpy()
 
-        if row["start"] > last_end + min_duration:
+    # Gap between the end of the previous interval and the start of the current one
+    last_end = np.concatenate([[0.0], end[:-1]])
+    gap = start > last_end + min_duration
 
-            # Add silence
-            result["tier"].append(row["tier"])
-            result["start"].append(last_end)
-            result["end"].append(row["start"])
-            result["annotation"].append(fill_symbol)
+    # Each annotation is shifted by the number of silences inserted before (and including) it
+    n_rows = len(start) + gap.sum()
+    annotation_idx = np.arange(len(start)) + np.cumsum(gap)
+    silence_idx = annotation_idx[gap] - 1
 
-        # Add annotation
-        result["tier"].append(row["tier"])
-        result["start"].append(row["start"])
-        result["end"].append(row["end"])
-        result["annotation"].append(row["annotation"])
+    result = {"tier": np.empty(n_rows, dtype=object), "start": np.empty(n_rows, dtype=float),
+              "end": np.empty(n_rows, dtype=float), "annotation": np.empty(n_rows, dtype=object)}
 
-        # Update
-        last_end = row["end"]
+    # Add annotation
+    result["tier"][annotation_idx] = tier
+    result["start"][annotation_idx] = start
+    result["end"][annotation_idx] = end
+    result["annotation"][annotation_idx] = annotation
 
-    if len(df[df["end"] < df["start"]]) > 0:
-        raise ValueError("end is before start")
+    # Add silence
+    result["tier"][silence_idx] = tier[gap]
+    result["start"][silence_idx] = last_end[gap]
+    result["end"][silence_idx] = start[gap]
+    result["annotation"][silence_idx] = fill_symbol
 
     return pd.DataFrame(result)
 
 
+@fill_doc
+def merge_rows(df: pd.DataFrame, target: None | str = None) -> pd.DataFrame:
+    """
+    Merge identical rows that are next to each other
+
+    Each run of identical annotations becomes a single interval going from the start of its first row to the start of
+    the next run (or to the end of the last row for the final run). If ``target`` is set, only runs of ``target`` are
+    merged (e.g. ``\"#\"`` to merge adjacent silences), each going to the end of its last row, and every other row is
+    kept as is (gaps between rows are kept).
+
+    Parameters
+    ----------
+    %(df)s
+    %(target)s
+
+    Returns
+    -------
+    %(df)s
+    """
+
+    if not len(df):
+        return df
+
+    annotation = df["annotation"].to_numpy()
+    codes, _ = pd.factorize(annotation)
+
+    # Rows other than `target` each start their own run
+    keep = None if target is None else annotation != target
+
+    first, start, end = _merge_runs(codes, df["start"].to_numpy(dtype=float), df["end"].to_numpy(dtype=float), keep)
+
+    return pd.DataFrame({"tier": df["tier"].to_numpy()[first], "start": start, "end": end,
+                         "annotation": annotation[first]})
+
+
 @fill_doc
 def check_parameters(params: Dict) -> None:
     """
@@ -102,6 +147,54 @@ def check_parameters(params: Dict) -> None:
 ########################################################################################################################
 
 
+def _merge_runs(codes: np.ndarray, start: np.ndarray, end: np.ndarray,
+                keep: None | np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Run-length encode ``codes`` and get the boundaries of each run
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        Integer code of the annotation of each row
+    start : np.ndarray
+        Start of each row
+    end : np.ndarray
+        End of each row
+    keep : None | np.ndarray
+        Boolean mask of rows that always start a new run, ignored if ``None``. If set, each run ends at the end of its
+        last row
+
+    Returns
+    -------
+    first : np.ndarray
+        Index of the first row of each run
+    start : np.ndarray
+        Start of each run
+    end : np.ndarray
+        End of each run (start of the next run, end of the last row for the last run or if ``keep`` is set)
+    """
+
+    if len(codes) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=float), np.empty(0, dtype=float)
+
+    new_run = np.empty(len(codes), dtype=bool)
+    new_run[0] = True
+    new_run[1:] = codes[1:] != codes[:-1]
+
+    if keep is not None:
+        new_run |= keep
+
+    first = np.flatnonzero(new_run)
+    run_start = start[first]
+
+    if keep is None:
+        run_end = np.append(start[first[1:]], end[-1])
+    else:
+        run_end = end[np.append(first[1:], len(codes)) - 1]
+
+    return first, run_start, run_end
+
+
 @fill_doc
 def _check_keys(params: dict, keys: List[str]) -> None:
     """
@@ -201,7 +294,7 @@ def _check_diarization(diarization: dict) -> None:
     _check_keys(diarization, ["backend"])
 
     backend = diarization["backend"]
-    if backend in ["sppas", "combined"]:
+    if backend in ["sppas", "ipus", "combined"]:
         _check_keys(diarization, ["sppas"])
         _check_sppas(diarization["sppas"])
 
@@ -265,21 +358,28 @@ def _check_pyannote(pyannote: dict) -> None:
 
     _check_keys(pyannote, ["auth_token", "use_cuda", "max_speakers"])
 
+    from autoannot.diarization.diarize_pyannote import load_pipeline  # noqa (circular import)
+
     auth_token = pyannote["auth_token"]
     if not isinstance(auth_token, str):
         raise TypeError(f"'auth_token' must be a 'str'")
 
-    pipeline = Pipeline.from_pretrained(checkpoint_path=PYANNOT_MODEL, use_auth_token=auth_token)
+    if not isinstance(pyannote["use_cuda"], bool):
+        raise TypeError(f"'use_cuda' must be a 'bool'")
+
+    # Loaded through the model registry so the pipeline is already warm when diarization starts
+    pipeline = load_pipeline(auth_token, pyannote["use_cuda"])
 
     if pipeline is None:
         raise ValueError(f"Could not load the pyannote model. Probably the 'auth_token' is invalid")
 
-    if not isinstance(pyannote["use_cuda"], bool):
-        raise TypeError(f"'use_cuda' must be a 'bool'")
-
     if not isinstance(pyannote["max_speakers"], int) or pyannote["max_speakers"] is not None:
         raise TypeError(f"'max_speakers' must be an 'int' or 'None'")
 
+    n_threads = pyannote.get("n_threads")
+    if n_threads is not None and (not isinstance(n_threads, int) or n_threads < 1):
+        raise TypeError(f"'n_threads' must be a positive 'int' or 'None'")
+
 
 def _check_combined(combined: dict) -> None:
     """
@@ -0,0 +1,276 @@
+import hashlib
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Tuple
+
+import librosa
+import numpy as np
+from scipy.io import wavfile
+
+# Sidecars of the decoded audio, None to decode every time
+_CACHE_DIR: None | Path = None
+_DISK_BUDGET: None | int = None
+_LOCK = threading.RLock()
+
+# File hashes already computed, path -> (size, modification time, hash)
+_HASHES: Dict[str, Tuple[int, int, str]] = {}
+
+CACHE_SUFFIX = ".npy"
+
+
+def load_audio(wav_file: str | Path, sample_rate: None | int = None) -> Tuple[np.ndarray, int]:
+    """
+    Load a file as mono float32 audio (between ``-1`` and ``1``), decoded once per sample rate
+
+    If a cache directory is set, the decoded audio is stored there as an ``.npy`` sidecar keyed by the hash of the file
+    and the sample rate, and returned memory-mapped (read only) by every later call, from any stage or process
+
+    Parameters
+    ----------
+    wav_file : str | Path
+        Path to the audio file
+    sample_rate : None | int
+        Sample rate to resample to, if ``None`` the native sample rate is kept
+
+    Returns
+    -------
+    data : np.ndarray
+        Mono float32 audio
+    sample_rate : int
+        Sample rate of ``data``
+    """
+
+    if sample_rate is None:
+        sample_rate = librosa.get_samplerate(str(wav_file))
+
+    if _CACHE_DIR is None:
+        data, _ = librosa.load(wav_file, sr=sample_rate, mono=True)
+        return data.astype(np.float32, copy=False), sample_rate
+
+    sidecar = _CACHE_DIR / f"{get_file_hash(wav_file)}_{sample_rate}{CACHE_SUFFIX}"
+
+    try:
+        os.utime(sidecar)  # most recently used
+        return np.load(sidecar, mmap_mode="r"), sample_rate
+
+    except FileNotFoundError:  # not decoded yet (or removed by another worker)
+        pass
+
+    data, _ = librosa.load(wav_file, sr=sample_rate, mono=True)
+
+    # Write the whole file at once so other workers never read it half written
+    temp_file = sidecar.parent / f"{sidecar.name}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temp_file, "wb") as f:
+        np.save(f, data.astype(np.float32, copy=False))
+    os.replace(temp_file, sidecar)
+
+    with _LOCK:
+        _enforce_budget(keep=sidecar)
+
+    return np.load(sidecar, mmap_mode="r"), sample_rate
+
+
+def open_audio(wav_file: str | Path, sample_rate: None | int = None) -> Tuple[np.ndarray, int]:
+    """
+    Open a file without loading it in memory, to read the segments that are needed with ``get_segment``
+
+    This is the decoded audio of the cache if it is set (see ``load_audio``). Otherwise PCM WAV files are
+    memory-mapped as they are (native sample rate, possibly several channels and integer samples), and other
+    files are decoded.
+
+    Parameters
+    ----------
+    wav_file : str | Path
+        Path to the audio file
+    sample_rate : None | int
+        Sample rate the segments will be read at (only used to decode the file once if needed)
+
+    Returns
+    -------
+    data : np.ndarray
+        Audio (samples or samples x channels)
+    sample_rate : int
+        Sample rate of ``data``
+    """
+
+    if _CACHE_DIR is not None:
+        return load_audio(wav_file, sample_rate)
+
+    try:
+        sample_rate, data = wavfile.read(wav_file, mmap=True)
+
+    except ValueError:  # not PCM WAV (e.g. 24-bit or compressed)
+        return load_audio(wav_file, sample_rate)
+
+    return data, sample_rate
+
+
+def get_segment(data: np.ndarray, data_rate: int, start: float, end: float,
+                sample_rate: None | int = None) -> np.ndarray:
+    """
+    Get a segment of the audio as mono float32 (between ``-1`` and ``1``)
+
+    Only the segment is read, downmixed, converted and resampled, so memory-mapped audio is never loaded as a whole
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Audio (samples or samples x channels), e.g. from ``open_audio``
+    data_rate : int
+        Sample rate of ``data``
+    start : float
+        Start of the segment in seconds
+    end : float
+        End of the segment in seconds
+    sample_rate : None | int
+        Sample rate to resample to, if ``None`` the one of ``data`` is kept
+
+    Returns
+    -------
+    segment : np.ndarray
+        Mono float32 audio
+    """
+
+    segment = _to_float(data[int(start * data_rate): int(end * data_rate)])
+
+    if segment.ndim == 2:  # samples x channels
+        segment = segment.mean(axis=1)
+
+    if sample_rate is not None and sample_rate != data_rate and len(segment) > 0:
+        segment = librosa.resample(segment, orig_sr=data_rate, target_sr=sample_rate)
+
+    return segment.astype(np.float32, copy=False)
+
+
+def set_audio_cache(cache_dir: None | str | Path, disk_budget: None | int = None) -> None:
+    """
+    Set the directory where decoded audio is kept, least recently used files are removed above the disk budget
+
+    Parameters
+    ----------
+    cache_dir : None | str | Path
+        Cache directory (created if needed), if ``None`` audio is decoded every time
+    disk_budget : None | int
+        Budget in bytes, ``None`` for no limit
+
+    Returns
+    -------
+    None
+    """
+
+    global _CACHE_DIR, _DISK_BUDGET
+
+    with _LOCK:
+
+        _CACHE_DIR = None if cache_dir is None else Path(cache_dir)
+        _DISK_BUDGET = disk_budget
+
+        if _CACHE_DIR is not None:
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            _enforce_budget()
+
+
+def get_file_hash(path: str | Path) -> str:
+    """
+    Get the hash of the content of a file (only computed again if the file has been modified)
+
+    Parameters
+    ----------
+    path : str | Path
+        Path to the file
+
+    Returns
+    -------
+    file_hash : str
+        SHA-1 of the file
+    """
+
+    path = str(Path(path).resolve())
+    stat = os.stat(path)
+
+    with _LOCK:
+        if path in _HASHES and _HASHES[path][:2] == (stat.st_size, stat.st_mtime_ns):
+            return _HASHES[path][2]
+
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+
+    with _LOCK:
+        _HASHES[path] = (stat.st_size, stat.st_mtime_ns, sha1.hexdigest())
+
+    return sha1.hexdigest()
+
+
+########################################################################################################################
+# Private methods                                                                                                      #
+########################################################################################################################
+
+
+def _to_float(data: np.ndarray) -> np.ndarray:
+    """
+    Convert PCM samples to float32 between ``-1`` and ``1`` (same scaling as librosa)
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Samples
+
+    Returns
+    -------
+    data : np.ndarray
+        Float32 samples
+    """
+
+    if data.dtype == np.uint8:
+        return (data.astype(np.float32) - 2 ** 7) / 2 ** 7
+
+    if np.issubdtype(data.dtype, np.integer):
+        return data.astype(np.float32) / -np.iinfo(data.dtype).min
+
+    return data.astype(np.float32)
+
+
+def _enforce_budget(keep: None | Path = None) -> None:
+    """
+    Remove least recently used sidecars until the cache fits in the disk budget
+
+    Parameters
+    ----------
+    keep : None | Path
+        Sidecar that must not be removed (the one being written)
+
+    Returns
+    -------
+    None
+    """
+
+    if _CACHE_DIR is None or _DISK_BUDGET is None:
+        return
+
+    sidecars = []
+    for path in _CACHE_DIR.glob(f"*{CACHE_SUFFIX}"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # removed by another worker
+            continue
+
+        sidecars.append((stat.st_mtime_ns, stat.st_size, path))
+
+    total = sum(size for _, size, _ in sidecars)
+    for _, size, path in sorted(sidecars, key=lambda sidecar: sidecar[0]):
+
+        if total <= _DISK_BUDGET:
+            break
+
+        if path == keep:
+            continue
+
+        try:
+            os.remove(path)  # files already memory-mapped stay readable until they are closed
+        except FileNotFoundError:
+            pass
+
+        total -= size
@@ -1,9 +1,11 @@
+from contextlib import contextmanager
+import fcntl
 import os
 from pathlib import Path
 import re
 import sys
 import tempfile
-from typing import List
+from typing import Iterator, List
 
 import pandas as pd
 
@@ -13,7 +15,9 @@ from autoannot.docs import fill_doc
 # Add SPPAS path
 sys.path.append(str(ROOT_DIR / "libs" / "SPPAS"))
 
-from sppas.src.anndata import sppasTrsRW  # noqa
+from sppas.src.anndata import sppasTrsRW, sppasTranscription  # noqa
+
+LOCK_SUFFIX = ".lock"
 
 
 @fill_doc
@@ -71,6 +75,34 @@ def convert_annotation(in_file: str | Path, out_file: str | Path) -> None:
         parser.write(trs)
 
 
+def trs_to_df(trs: sppasTranscription) -> pd.DataFrame:
+    """
+    Convert a SPPAS transcription to the same DataFrame as its CSV export
+
+    Parameters
+    ----------
+    trs : sppasTranscription
+        SPPAS transcription, e.g. the output of an annotator run without output file
+
+    Returns
+    -------
+    df : pd.DataFrame
+        TextGrid compatible DataFrame
+    """
+
+    results = {"tier": [], "start": [], "end": [], "annotation": []}
+
+    for tier in trs.get_tier_list():
+        for annotation in tier:
+
+            results["tier"].append(tier.get_name())
+            results["start"].append(annotation.get_lowest_localization().get_midpoint())
+            results["end"].append(annotation.get_highest_localization().get_midpoint())
+            results["annotation"].append(annotation.serialize_labels(separator=" "))
+
+    return pd.DataFrame(results)
+
+
 @fill_doc
 def to_textgrid(out_file: str | Path, df: pd.DataFrame) -> None:
     """
@@ -92,3 +124,30 @@ def to_textgrid(out_file: str | Path, df: pd.DataFrame) -> None:
         df.to_csv(temp_dir / "annotation.csv", header=False)
 
         convert_annotation(temp_dir / "annotation.csv", out_file)
+
+
+@contextmanager
+def lock_file(path: str | Path) -> Iterator[None]:
+    """
+    Lock a file against every other process and thread until the end of the ``with`` block, e.g. around reading it
+    and replacing it
+
+    The lock is taken on a sidecar ``.lock`` file, so the file itself can be replaced while it is locked
+
+    Parameters
+    ----------
+    path : str | Path
+        Path to the file
+
+    Returns
+    -------
+    None
+    """
+
+    with open(f"{path}{LOCK_SUFFIX}", "a") as f:
+
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
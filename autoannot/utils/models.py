@@ -0,0 +1,192 @@
+from collections import OrderedDict
+import threading
+from typing import Any, Callable, Tuple
+
+import torch
+
+# Loaded models in least recently used order, (backend, model name, device, adapter) -> (model, size in bytes)
+_MODELS: OrderedDict = OrderedDict()
+_LOCK = threading.RLock()
+_MEMORY_BUDGET: None | int = None
+
+
+def get_model(backend: str, model_name: str, device: str, loader: Callable[[], Any],
+              adapter: None | str = None) -> Any:
+    """
+    Get a model from the process-wide registry, loading it with ``loader`` only if it has not been loaded yet
+
+    Parameters
+    ----------
+    backend : str
+        Name of the backend e.g. ``\"pyannote\"``, ``\"whisper\"`` or ``\"wav2vec2\"``
+    model_name : str
+        Name of the model
+    device : str
+        Device the model is loaded on e.g. ``\"cpu\"`` or ``\"cuda\"``
+    loader : Callable[[], Any]
+        Function returning the loaded model
+    adapter : None | str
+        Name of the adapter loaded on top of the model (e.g. language), ``None`` if there is none
+
+    Returns
+    -------
+    model : Any
+        Loaded model (``None`` is returned as is and not kept in the registry)
+    """
+
+    key = (backend, model_name, device, adapter)
+
+    with _LOCK:
+
+        if key in _MODELS:
+            _MODELS.move_to_end(key)
+            return _MODELS[key][0]
+
+        model = loader()
+        if model is None:
+            return None
+
+        size = _get_size(model)
+
+        _MODELS[key] = (model, size)
+        _enforce_budget(keep=key)
+
+        return model
+
+
+def evict_model(backend: str, model_name: str, device: str, adapter: None | str = None) -> bool:
+    """
+    Remove a model from the registry
+
+    Parameters
+    ----------
+    backend : str
+        Name of the backend
+    model_name : str
+        Name of the model
+    device : str
+        Device the model is loaded on
+    adapter : None | str
+        Name of the adapter loaded on top of the model
+
+    Returns
+    -------
+    evicted : bool
+        ``True`` if the model was in the registry
+    """
+
+    with _LOCK:
+        return _MODELS.pop((backend, model_name, device, adapter), None) is not None
+
+
+def clear_models() -> None:
+    """
+    Remove all models from the registry
+
+    Returns
+    -------
+    None
+    """
+
+    with _LOCK:
+        _MODELS.clear()
+
+
+def set_memory_budget(memory_budget: None | int) -> None:
+    """
+    Set the maximum total size of the models kept in the registry, least recently used models are evicted first
+
+    Parameters
+    ----------
+    memory_budget : None | int
+        Budget in bytes, ``None`` for no limit
+
+    Returns
+    -------
+    None
+    """
+
+    global _MEMORY_BUDGET
+
+    with _LOCK:
+        _MEMORY_BUDGET = memory_budget
+        _enforce_budget()
+
+
+def get_device(use_cuda: bool) -> str:
+    """
+    Get the name of the device to load models on
+
+    Parameters
+    ----------
+    use_cuda : bool
+        if ``True``, use GPU (if available)
+
+    Returns
+    -------
+    device : str
+        ``\"cuda\"`` or ``\"cpu\"``
+    """
+
+    return "cuda" if torch.cuda.is_available() and use_cuda else "cpu"
+
+
+########################################################################################################################
+# Private methods                                                                                                      #
+########################################################################################################################
+
+
+def _enforce_budget(keep: None | Tuple = None) -> None:
+    """
+    Evict least recently used models until the registry fits in the memory budget
+
+    Parameters
+    ----------
+    keep : None | Tuple
+        Key of a model that must not be evicted (the one being loaded)
+
+    Returns
+    -------
+    None
+    """
+
+    if _MEMORY_BUDGET is None:
+        return
+
+    for key in list(_MODELS.keys()):
+
+        if sum(size for _, size in _MODELS.values()) <= _MEMORY_BUDGET:
+            break
+
+        if key != keep:
+            del _MODELS[key]
+
+
+def _get_size(model: Any, depth: int = 2) -> int:
+    """
+    Estimate the memory used by the parameters and buffers of ``model`` (and of the modules it holds)
+
+    Parameters
+    ----------
+    model : Any
+        Loaded model, a tuple of models or an object holding models (e.g. a pipeline)
+    depth : int
+        How many levels of attributes to look into for objects that are not modules
+
+    Returns
+    -------
+    size : int
+        Size in bytes
+    """
+
+    if isinstance(model, (tuple, list)):
+        return sum(_get_size(item, depth) for item in model)
+
+    if callable(getattr(model, "parameters", None)) and callable(getattr(model, "buffers", None)):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    if depth == 0 or not hasattr(model, "__dict__"):
+        return 0
+
+    return sum(_get_size(value, depth - 1) for value in vars(model).values())
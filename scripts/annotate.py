@@ -6,7 +6,12 @@ from typing import Dict
 import pandas as pd
 from joblib import Parallel, delayed
 
-from autoannot import diarize, transcribe, align, get_wav_paths, get_path_list
+from autoannot import diarize, align, get_wav_paths, get_path_list
+from autoannot.alignment.julius import set_phon_cache
+from autoannot.diarization.quality import merge_quality_log
+from autoannot.transcription.transcribe import transcribe_corpus
+from autoannot.utils.audio import set_audio_cache
+from autoannot.utils.models import set_memory_budget
 
 
 def annotate(params: Dict):
@@ -23,6 +28,15 @@ def annotate(params: Dict):
     # Get WAV paths
     wav_list = get_wav_paths(src_dir)
 
+    # Models are loaded once and reused across files, evicted when above the budget (in bytes)
+    set_memory_budget(params["advanced"].get("model_memory_budget"))
+
+    # Audio is decoded once per sample rate and shared by all stages, evicted when above the budget (in bytes)
+    set_audio_cache(params["advanced"].get("audio_cache_dir"), params["advanced"].get("audio_cache_budget"))
+
+    # Pronunciations found by SPPAS are reused by the next files and runs (discarded if the dictionary changes)
+    set_phon_cache(params["advanced"].get("phon_cache"))
+
     # Save all errors
     errors = {"file": [], "error": []}
 
@@ -32,18 +46,22 @@ def annotate(params: Dict):
         log_dir = _make_dirs(dst_dir, "error_logs")
 
         dia_list = get_path_list(dia_dir, wav_list, extension="csv", suffix="diarization")
-        log_list = get_path_list(log_dir, wav_list, extension="log", suffix="error")
 
-        # Parallel(n_jobs=n_jobs)(delayed(diarize)(w, o, l, params) for w, o, l in zip(wav_list, dia_list, log_list))
-        for w, o, l in zip(wav_list, dia_list, log_list):
+        # Workers record SPPAS quality in their own shards, merged into a single table once they are all done
+        quality_log = log_dir / "sppas_quality.csv"
+
+        # Parallel(n_jobs=n_jobs)(delayed(diarize)(w, o, quality_log, params) for w, o in zip(wav_list, dia_list))
+        for w, o in zip(wav_list, dia_list):
 
             try:
-                diarize(w, o, l, params)
+                diarize(w, o, quality_log, params)
 
             except Exception:  # noqa
                 errors["file"].append(os.path.basename(w))
                 errors["error"].append(traceback.format_exc())
 
+        merge_quality_log(quality_log)
+
     # Transcribe
     if _make_transcription(dst_dir, wav_list, use_existing, target):
 
@@ -52,15 +70,12 @@ def annotate(params: Dict):
         dia_dir = _make_dirs(dst_dir, "diarizations")
         dia_list = get_path_list(dia_dir, wav_list, extension="csv", suffix="diarization")
 
+        # IPUs of consecutive files share the same batches (wav2vec2), a failure only affects its own file
         # Parallel(n_jobs=n_jobs)(delayed(transcribe)(w, t, d, params) for w, t, d in zip(wav_list, trs_list, dia_list))
-        for w, t, d in zip(wav_list, trs_list, dia_list):
+        trs_errors = transcribe_corpus(wav_list, trs_list, dia_list, params)
 
-            try:
-                transcribe(w, t, d, params)
-
-            except Exception:  # noqa
-                errors["file"].append(os.path.basename(w))
-                errors["error"].append(traceback.format_exc())
+        errors["file"].extend(trs_errors["file"])
+        errors["error"].extend(trs_errors["error"])
 
     # Align
     if _make_alignment(dst_dir, wav_list, use_existing, target):
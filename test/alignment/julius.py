@@ -1,12 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
 import json
+import os
 from pathlib import Path
 import tempfile
 import unittest
+from unittest import mock
 
 import pandas as pd
 
 from autoannot import ROOT_DIR
-from autoannot.alignment.julius import palign
+from autoannot.alignment.julius import DICT_PATH, JuliusAligner, MODEL_PATH, palign, palign_chunked
+from autoannot.alignment.julius import _load_phon_cache, _save_phon_cache
+from autoannot.utils.audio import get_file_hash
+from autoannot.utils.files import trs_to_df
+from autoannot.utils.models import clear_models, get_model
+
+from sppas.src.anndata import sppasTrsRW  # noqa
 
 TEST_WAV_FILE = ROOT_DIR / "data" / "test" / "wav_dir" / "AB-buzz.wav"
 TEST_PARAMETERS_FILE = ROOT_DIR / "data" / "parameters.json"
@@ -32,3 +41,117 @@ class Julius(unittest.TestCase):
         df = pd.read_csv(out_file)
         print(df)
         self.temp_dir.cleanup()
+
+    def test_julius_aligner(self):
+
+        clear_models()
+        aligner = JuliusAligner()
+
+        # Same resources for all files, no intermediate file left
+        out_files = [self.temp_dir_name / f"julius_transcription_{i}.csv" for i in range(2)]
+        aligner.align_files([TEST_WAV_FILE] * 2, out_files, [TEST_TRANSCRIPTION_FILE] * 2)
+
+        pd.testing.assert_frame_equal(pd.read_csv(out_files[0]), pd.read_csv(out_files[1]))
+        self.assertEqual([], list(aligner.tmp_dir.iterdir()))
+        aligner.close()
+
+        # palign loads its aligner once and keeps it in the registry
+        palign(TEST_WAV_FILE, out_files[0], TEST_TRANSCRIPTION_FILE)
+        self.assertIsInstance(get_model("julius", str(MODEL_PATH), "cpu", loader=lambda: None), JuliusAligner)
+
+        self.temp_dir.cleanup()
+
+    def test_julius_chunked(self):
+
+        out_file = self.temp_dir_name / "julius_transcription.TextGrid"
+        chunked_file = self.temp_dir_name / "julius_transcription_chunked.TextGrid"
+        palign(TEST_WAV_FILE, out_file, TEST_TRANSCRIPTION_FILE)
+        palign_chunked(TEST_WAV_FILE, chunked_file, TEST_TRANSCRIPTION_FILE, n_jobs=2)
+
+        # Same tiers covering the whole recording
+        df = trs_to_df(sppasTrsRW(str(out_file)).read())
+        chunked_df = trs_to_df(sppasTrsRW(str(chunked_file)).read())
+
+        self.assertEqual(set(df["tier"]), set(chunked_df["tier"]))
+        for tier, tier_df in chunked_df.groupby("tier"):
+            self.assertTrue((tier_df["start"].to_numpy()[1:] >= tier_df["end"].to_numpy()[:-1] - 1e-6).all())
+
+            # Silences at the edges of the IPUs are merged
+            silence = (tier_df["annotation"] == "#").to_numpy()
+            self.assertFalse((silence[1:] & silence[:-1]).any())
+
+        self.temp_dir.cleanup()
+
+    def test_julius_chunked_failure(self):
+
+        chunked_file = self.temp_dir_name / "julius_transcription_chunked.TextGrid"
+
+        # Alignment of the first IPU fails
+        align = JuliusAligner.align
+        calls = []
+
+        def align_once_failing(aligner, *args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise ValueError("Julius failed")
+            align(aligner, *args)
+
+        with mock.patch.object(JuliusAligner, "align", autospec=True, side_effect=align_once_failing):
+            with self.assertRaisesRegex(RuntimeError, "Julius failed"):
+                palign_chunked(TEST_WAV_FILE, chunked_file, TEST_TRANSCRIPTION_FILE, n_jobs=1)
+
+        # The other IPUs are written, the failed one is kept without labels instead of a silence
+        ipu_df = pd.read_csv(TEST_TRANSCRIPTION_FILE).dropna(subset=["annotation"])
+        ipu = ipu_df[ipu_df["annotation"] != "#"].iloc[0]
+
+        chunked_df = trs_to_df(sppasTrsRW(str(chunked_file)).read())
+        for tier, tier_df in chunked_df.groupby("tier"):
+            failed_df = tier_df[(tier_df["start"] - ipu["start"]).abs() < 1e-3]
+            self.assertEqual([""], failed_df["annotation"].to_list())
+            self.assertAlmostEqual(ipu["end"], failed_df["end"].iloc[0], places=3)
+            self.assertGreater(len(tier_df[~tier_df["annotation"].isin(["", "#"])]), 0)
+
+        self.temp_dir.cleanup()
+
+    def test_julius_phon_cache(self):
+
+        cache_file = self.temp_dir_name / "phon_cache.json"
+        out_file = self.temp_dir_name / "julius_transcription.TextGrid"
+        cached_file = self.temp_dir_name / "julius_transcription_cached.TextGrid"
+
+        JuliusAligner().align(TEST_WAV_FILE, out_file, TEST_TRANSCRIPTION_FILE)
+
+        # Words phonetized by SPPAS are kept in memory, then saved with the checksum of the dictionary
+        aligner = JuliusAligner(phon_cache=cache_file)
+        aligner.align(TEST_WAV_FILE, cached_file, TEST_TRANSCRIPTION_FILE)
+        self.assertFalse(cache_file.exists())
+        aligner.close()
+
+        with open(cache_file, "r") as f:
+            content = json.load(f)
+        self.assertEqual(get_file_hash(DICT_PATH), content["dict_checksum"])
+        self.assertGreater(len(content["words"]), 0)
+
+        # Next run only reads the cache, same alignment as without it
+        modified = os.stat(cache_file).st_mtime_ns
+        JuliusAligner(phon_cache=cache_file).align_files([TEST_WAV_FILE], [cached_file], [TEST_TRANSCRIPTION_FILE])
+        self.assertEqual(modified, os.stat(cache_file).st_mtime_ns)
+
+        pd.testing.assert_frame_equal(trs_to_df(sppasTrsRW(str(out_file)).read()),
+                                      trs_to_df(sppasTrsRW(str(cached_file)).read()))
+
+        self.temp_dir.cleanup()
+
+    def test_julius_phon_cache_processes(self):
+
+        cache_file = self.temp_dir_name / "phon_cache.json"
+        words = [{f"word_{i}": [["w", "o", "r", "d"]]} for i in range(40)]
+
+        # Workers of other processes keep each other's words
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(_save_phon_cache, [cache_file] * len(words), ["checksum"] * len(words), words))
+
+        self.assertEqual({word for word_cache in words for word in word_cache},
+                         set(_load_phon_cache(cache_file, "checksum")))
+
+        self.temp_dir.cleanup()
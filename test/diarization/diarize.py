@@ -1,12 +1,15 @@
 import json
 from pathlib import Path
 import tempfile
+import threading
 import unittest
+from unittest import mock
 
+import numpy as np
 import pandas as pd
 
 from autoannot import ROOT_DIR
-from autoannot.diarization.diarize import diarize
+from autoannot.diarization.diarize import diarize, _combine, _diarize_combined, _sweep
 
 TEST_WAV_FILE = ROOT_DIR / "data" / "test" / "wav_dir" / "AB-buzz.wav"
 TEST_PARAMETERS_FILE = ROOT_DIR / "data" / "parameters.json"
@@ -33,3 +36,119 @@ class Diarize(unittest.TestCase):
         df = pd.read_csv(test_out_file, header=None, names=["tier", "start", "end", "annotation"])
 
         self.temp_dir.cleanup()
+
+
+class Sweep(unittest.TestCase):
+
+    @staticmethod
+    def _make_tier(rng, n_rows, labels, overlap=False):
+        """Random tier covering [0, 100] (possibly with overlapping intervals)"""
+
+        boundaries = np.round(np.sort(rng.uniform(0, 100, n_rows - 1)), 3)
+        boundaries = np.concatenate([[0.0], boundaries, [100.0]])
+        start, end = boundaries[:-1], boundaries[1:].copy()
+
+        if overlap:
+            end += rng.uniform(0, 2, n_rows) * (rng.random(n_rows) < 0.3)
+
+        return pd.DataFrame({"tier": "test", "start": start, "end": end, "annotation": rng.choice(labels, n_rows)})
+
+    @staticmethod
+    def _reference(sppas_df, pyannote_df):
+        """Cursor moved one boundary at a time with a full scan of both tiers at each step"""
+
+        cursor = 0.0
+        last = min(sppas_df.iloc[-1]["end"], pyannote_df.iloc[-1]["end"])
+        result = []
+
+        while cursor < last:
+
+            sppas_match = sppas_df[(sppas_df["start"] <= cursor) & (cursor < sppas_df["end"])].iloc[0]
+            pyannot_match = pyannote_df[(pyannote_df["start"] <= cursor) & (cursor < pyannote_df["end"])].iloc[0]
+
+            annotation = "#" if sppas_match["annotation"] == "#" or pyannot_match["annotation"] == "#" else "ipu"
+
+            end = min(sppas_match["end"], pyannot_match["end"])
+            result.append((cursor, end, annotation))
+            cursor = end
+
+        return result
+
+    def test_sweep(self):
+
+        rng = np.random.default_rng(0)
+
+        for trial in range(100):
+
+            sppas_df = self._make_tier(rng, rng.integers(1, 40), ["#", "ipu_1"])
+            pyannote_df = self._make_tier(rng, rng.integers(1, 40), ["#", "SPEAKER_00", "SPEAKER_01"],
+                                          overlap=trial % 2 == 0)
+
+            start, end, silence = _sweep(sppas_df, pyannote_df)
+            result = list(zip(start.tolist(), end.tolist(), np.where(silence, "#", "ipu").tolist()))
+
+            self.assertEqual(self._reference(sppas_df, pyannote_df), result)
+
+    def test_sweep_gap(self):
+
+        sppas_df = pd.DataFrame({"tier": "test", "start": [0.0, 1.0], "end": [1.0, 2.0], "annotation": ["#", "ipu"]})
+        pyannote_df = pd.DataFrame({"tier": "test", "start": [0.0, 1.5], "end": [1.0, 2.0],
+                                    "annotation": ["#", "SPEAKER_00"]})
+
+        with self.assertRaises(ValueError):
+            _sweep(sppas_df, pyannote_df)
+
+
+class Combine(unittest.TestCase):
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_name = Path(self.temp_dir.name)
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def test_combine(self):
+
+        sppas_df = pd.DataFrame({"tier": "IPUs", "start": [0.0, 1.0, 3.0], "end": [1.0, 3.0, 4.0],
+                                 "annotation": ["#", "ipu_1", "#"]})
+        pyannote_df = pd.DataFrame({"tier": "pyannote", "start": [0.0, 0.5, 2.0], "end": [0.5, 2.0, 4.0],
+                                    "annotation": ["#", "SPEAKER_00", "#"]})
+
+        out_file = self.temp_dir_name / "combined.csv"
+        _combine(sppas_df, pyannote_df, out_file)
+
+        df = pd.read_csv(out_file)
+        self.assertEqual(["#", "ipu", "#"], df["annotation"].to_list())
+        self.assertEqual([0.0, 1.0, 2.0], df["start"].to_list())
+        self.assertEqual([1.0, 2.0, 4.0], df["end"].to_list())
+
+    def test_diarize_combined(self):
+
+        sppas_df = pd.DataFrame({"tier": "IPUs", "start": [0.0, 1.0, 3.0], "end": [1.0, 3.0, 4.0],
+                                 "annotation": ["#", "ipu_1", "#"]})
+        pyannote_df = pd.DataFrame({"tier": "pyannote", "start": [0.0, 0.5, 2.0], "end": [0.5, 2.0, 4.0],
+                                    "annotation": ["#", "SPEAKER_00", "#"]})
+
+        params = {"sppas": {"min_sil": None}, "pyannote": {"max_speakers": None, "n_threads": 2},
+                  "combined": {"tier_name": "combined", "min_duration": 0.0}}
+        out_file = self.temp_dir_name / "combined.csv"
+        module = "autoannot.diarization.diarize"
+
+        # Torch threads set from this thread only, around both backends
+        calls = []
+        with mock.patch(f"{module}.diarize_sppas", return_value=sppas_df) as sppas, \
+                mock.patch(f"{module}.diarize_pyannote", return_value=pyannote_df) as pyannote, \
+                mock.patch(f"{module}.torch.get_num_threads", return_value=8), \
+                mock.patch(f"{module}.torch.set_num_threads",
+                           side_effect=lambda n: calls.append((n, threading.current_thread()))):
+            _diarize_combined("audio.wav", out_file, None, **params)
+
+        self.assertEqual([(2, threading.current_thread()), (8, threading.current_thread())], calls)
+        sppas.assert_called_once_with("audio.wav", None, None, min_sil=None)
+        pyannote.assert_called_once_with("audio.wav", None, max_speakers=None, n_threads=None)
+
+        df = pd.read_csv(out_file)
+        self.assertEqual(["#", "ipu", "#"], df["annotation"].to_list())
@@ -0,0 +1,110 @@
+import json
+from pathlib import Path
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from autoannot import ROOT_DIR
+from autoannot.diarization.diarize_ipus import diarize_ipus, search_ipus, search_threshold
+from autoannot.diarization.diarize_sppas import diarize_sppas
+
+TEST_WAV_FILE = ROOT_DIR / "data" / "test" / "wav_dir" / "AB-buzz.wav"
+TEST_PARAMETERS_FILE = ROOT_DIR / "data" / "parameters.json"
+
+
+class SearchIPUs(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sample_rate = 16_000
+        rng = np.random.default_rng(0)
+
+        # Background noise with bursts of speech-like noise
+        self.wav_data = rng.normal(0, 30, 10 * self.sample_rate)
+        for start, end in [(1.0, 2.0), (2.03, 3.0), (5.0, 5.05), (6.0, 8.5)]:
+            start, end = int(start * self.sample_rate), int(end * self.sample_rate)
+            self.wav_data[start: end] += rng.normal(0, 3000, end - start)
+
+    def test_search_ipus(self):
+
+        start, end = search_ipus(self.wav_data, self.sample_rate, min_sil=0.05, min_ipu=0.1,
+                                 shift_start=0.01, shift_end=0.01)
+
+        # The short silence is merged, the short burst is dropped
+        np.testing.assert_allclose([0.99, 5.99], start)
+        np.testing.assert_allclose([3.01, 8.51], end)
+
+    def test_search_ipus_threshold(self):
+
+        # Nothing is louder than the threshold
+        start, end = search_ipus(self.wav_data, self.sample_rate, threshold=10 ** 6)
+
+        self.assertEqual(0, len(start))
+        self.assertEqual(0, len(end))
+
+
+class SearchThreshold(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sample_rate = 16_000
+        rng = np.random.default_rng(0)
+
+        # Loud bursts every second with quieter ones in between
+        self.wav_data = rng.normal(0, 30, 20 * self.sample_rate)
+        for i in range(20):
+            start, end = int(i * self.sample_rate), int((i + 0.3) * self.sample_rate)
+            self.wav_data[start: end] += rng.normal(0, 3000 if i % 2 else 300, end - start)
+
+    def test_search_threshold(self):
+
+        # Only the loud bursts pass a high threshold (10 IPUs), the quiet ones a lower one (20 IPUs, 40 intervals)
+        threshold = search_threshold(self.wav_data, self.sample_rate, min_n_ipus=25, min_mean_duration=60,
+                                     thresholds=[50, 150, 1500, 10 ** 6])
+
+        self.assertIn(threshold, [50, 150])
+
+        start, _ = search_ipus(self.wav_data, self.sample_rate, threshold=threshold)
+        self.assertEqual(20, len(start))
+
+    def test_search_threshold_none(self):
+
+        threshold = search_threshold(self.wav_data, self.sample_rate, min_n_ipus=100, min_mean_duration=60)
+
+        self.assertIsNone(threshold)
+
+
+class DiarizeIPUs(unittest.TestCase):
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_name = Path(self.temp_dir.name)
+
+        with open(TEST_PARAMETERS_FILE, "r") as f:
+            self.params = json.load(f)["diarization"]["sppas"]
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def test_same_as_sppas(self):
+
+        error_log_file = self.temp_dir_name / "error_log.log"
+
+        sppas_df = diarize_sppas(TEST_WAV_FILE, None, error_log_file, **self.params)
+        ipus_df = diarize_ipus(TEST_WAV_FILE, self.temp_dir_name / "ipus.csv", error_log_file, **self.params)
+
+        # Same format as SPPAS
+        df = pd.read_csv(self.temp_dir_name / "ipus.csv", header=None, names=["tier", "start", "end", "annotation"])
+        self.assertEqual(list(df["annotation"]), list(ipus_df["annotation"]))
+
+        # Same IPUs within tolerance
+        sppas_df = sppas_df[sppas_df["annotation"] != "#"]
+        ipus_df = ipus_df[ipus_df["annotation"] != "#"]
+
+        self.assertEqual(len(sppas_df), len(ipus_df))
+        np.testing.assert_allclose(sppas_df["start"], ipus_df["start"], atol=0.05)
+        np.testing.assert_allclose(sppas_df["end"], ipus_df["end"], atol=0.05)
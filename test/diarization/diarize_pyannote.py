@@ -3,10 +3,12 @@ from pathlib import Path
 import tempfile
 import unittest
 
+import numpy as np
 import pandas as pd
+from pyannote.core import Annotation, Segment
 
 from autoannot import ROOT_DIR
-from autoannot.diarization.diarize_pyannote import diarize_pyannote, get_main_speaker
+from autoannot.diarization.diarize_pyannote import diarize_pyannote, get_main_speaker, _convert_to_df, _get_intensity
 
 TEST_WAV_FILE = ROOT_DIR / "data" / "test" / "wav_dir" / "AB-buzz.wav"
 TEST_PARAMETERS_FILE = ROOT_DIR / "data" / "parameters.json"
@@ -49,3 +51,42 @@ class GetMainSpeaker(unittest.TestCase):
         self.assertEquals(str, type(main_speaker))
         self.assertEquals(str, type(candidates))
         self.assertEquals(bool, type(loud_and_short))
+
+
+class ConvertToDF(unittest.TestCase):
+
+    def test_convert_to_df(self):
+
+        diarization = Annotation()
+        diarization[Segment(0.5, 1.25)] = "SPEAKER_100"  # more than 99 speakers
+        diarization[Segment(2.0, 3.0)] = "unusual label"
+
+        df = _convert_to_df(diarization)
+
+        self.assertEqual(["#", "SPEAKER_100", "#", "unusual label"], df["annotation"].to_list())
+        self.assertEqual([0.0, 0.5, 1.25, 2.0], df["start"].to_list())
+        self.assertEqual([0.5, 1.25, 2.0, 3.0], df["end"].to_list())
+
+    def test_convert_to_df_empty(self):
+
+        self.assertEqual(0, len(_convert_to_df(Annotation())))
+
+
+class GetIntensity(unittest.TestCase):
+
+    def test_get_intensity(self):
+
+        sample_rate = 100
+        wav_data = np.random.default_rng(0).normal(size=10 * sample_rate)
+        cumsum = np.concatenate([[0.0], np.cumsum(np.abs(wav_data))])
+
+        start = np.array([0.0, 1.25, 9.5, 3.0])
+        end = np.array([1.0, 4.5, 12.0, 3.0])
+        intensity = _get_intensity(start, end, cumsum, sample_rate)
+
+        for i in range(3):
+            expected = np.abs(wav_data[int(start[i] * sample_rate): int(end[i] * sample_rate)]).mean()
+            self.assertAlmostEqual(expected, intensity[i])
+
+        # Empty segment
+        self.assertTrue(np.isnan(intensity[3]))
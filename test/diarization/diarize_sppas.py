@@ -1,4 +1,6 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import json
+import os
 from pathlib import Path
 import tempfile
 import unittest
@@ -6,7 +8,8 @@ import unittest
 import pandas as pd
 
 from autoannot import ROOT_DIR
-from autoannot.diarization.diarize_sppas import diarize_sppas
+from autoannot.diarization.diarize_sppas import diarize_sppas, diarize_sppas_corpus
+from autoannot.diarization.quality import load_manual_thresholds, record_quality, record_threshold, merge_quality_log
 
 TEST_WAV_FILE = ROOT_DIR / "data" / "test" / "wav_dir" / "AB-buzz.wav"
 TEST_PARAMETERS_FILE = ROOT_DIR / "data" / "parameters.json"
@@ -37,3 +40,108 @@ class DiarizeSPPAS(unittest.TestCase):
         df = pd.read_csv(test_out_file, header=None, names=["tier", "start", "end", "annotation"])
 
         self.temp_dir.cleanup()
+
+    def test_sppas_diarization_corpus(self):
+
+        in_files = [TEST_WAV_FILE, TEST_WAV_FILE]
+        out_files = [self.temp_dir_name / "test_diarization_1.csv", self.temp_dir_name / "test_diarization_2.csv"]
+        error_log_file = self.temp_dir_name / "error_log.log"
+
+        df_list, quality_df = diarize_sppas_corpus(in_files, out_files, error_log_file, **self.params)
+
+        self.assertEqual(2, len(df_list))
+        self.assertEqual(["name", "n_ipus", "ok"], list(quality_df.columns))
+        pd.testing.assert_frame_equal(df_list[0], df_list[1])
+
+        for out_file in out_files:
+            self.assertTrue(out_file.exists())
+
+        self.temp_dir.cleanup()
+
+
+class LoadManualThresholds(unittest.TestCase):
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.manual_thresholds = Path(self.temp_dir.name) / "thresholds.csv"
+
+        pd.DataFrame({"file": ["a.wav", "b.wav", "a.wav"], "threshold": [10, 20, 30]}).to_csv(self.manual_thresholds,
+                                                                                            index=False)
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def test_load_manual_thresholds(self):
+
+        manual_dict = load_manual_thresholds(self.manual_thresholds)
+
+        self.assertEqual({"a.wav": 10, "b.wav": 20}, manual_dict)
+        self.assertIs(manual_dict, load_manual_thresholds(self.manual_thresholds))
+
+    def test_load_manual_thresholds_modified(self):
+
+        load_manual_thresholds(self.manual_thresholds)
+
+        pd.DataFrame({"file": ["c.wav"], "threshold": [40]}).to_csv(self.manual_thresholds, index=False)
+        stat = os.stat(self.manual_thresholds)
+        os.utime(self.manual_thresholds, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        self.assertEqual({"c.wav": 40}, load_manual_thresholds(self.manual_thresholds))
+
+    def test_record_threshold(self):
+
+        record_threshold(self.manual_thresholds, "a.wav", 50)
+        record_threshold(self.manual_thresholds, "c.wav", 60)
+
+        manual_df = pd.read_csv(self.manual_thresholds)
+        self.assertEqual({"a.wav": 50, "b.wav": 20, "c.wav": 60}, dict(zip(manual_df["file"], manual_df["threshold"])))
+
+        # A new file is created if needed
+        new_thresholds = self.manual_thresholds.parent / "new_thresholds.csv"
+        record_threshold(new_thresholds, "a.wav", 50)
+        self.assertEqual(["file", "threshold"], list(pd.read_csv(new_thresholds).columns))
+
+    def test_record_threshold_processes(self):
+
+        names = [f"{i}.wav" for i in range(40)]
+
+        # Workers of other processes keep each other's thresholds
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(record_threshold, [self.manual_thresholds] * len(names), names, range(len(names))))
+
+        manual_df = pd.read_csv(self.manual_thresholds)
+        self.assertEqual(set(names) | {"a.wav", "b.wav"}, set(manual_df["file"]))
+
+
+class QualityLog(unittest.TestCase):
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.error_log = Path(self.temp_dir.name) / "logs" / "error_log.csv"
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def test_merge_quality_log(self):
+
+        names = [f"file_{i}.wav" for i in range(100)]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda name: record_quality(self.error_log, name, 10, True), names))
+
+        quality_df = merge_quality_log(self.error_log)
+
+        self.assertEqual(["name", "n_ipus", "ok"], list(quality_df.columns))
+        self.assertEqual(sorted(names), sorted(quality_df["name"]))
+        self.assertEqual([self.error_log], list(self.error_log.parent.iterdir()))
+
+        # Records from a later run are added to the existing table
+        record_quality(self.error_log, "other.wav", 0, False)
+        quality_df = merge_quality_log(self.error_log)
+
+        self.assertEqual(101, len(quality_df))
+        self.assertFalse(quality_df[quality_df["name"] == "other.wav"].iloc[0]["ok"])
@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from autoannot.transcription.filter_ipus import filter_ipus
+
+
+class FilterIPUs(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sample_rate = 16_000
+        rng = np.random.default_rng(0)
+
+        # Loud, short and quiet IPUs
+        self.data = np.zeros(4 * self.sample_rate, dtype=np.float32)
+        self.data[:self.sample_rate] = rng.normal(0, 0.1, self.sample_rate)
+        self.data[self.sample_rate: 2 * self.sample_rate] = rng.normal(0, 0.1, self.sample_rate)
+        self.data[2 * self.sample_rate: 3 * self.sample_rate] = rng.normal(0, 0.0001, self.sample_rate)
+
+        self.ipu_df = pd.DataFrame({"start": [0.0, 1.0, 2.0, 3.5], "end": [1.0, 1.02, 3.0, 3.5],
+                                    "annotation": "ipu"})
+
+    def test_filter_ipus(self):
+
+        keep = filter_ipus(self.data, self.sample_rate, self.ipu_df, min_duration=0.05, min_rms=0.001)
+
+        np.testing.assert_array_equal([True, False, False, False], keep)
+
+    def test_filter_ipus_int16(self):
+
+        # Same decision on the raw samples of a WAV file
+        data = np.round(self.data * 2 ** 15).astype(np.int16)
+        keep = filter_ipus(data, self.sample_rate, self.ipu_df, min_duration=0.05, min_rms=0.001)
+
+        np.testing.assert_array_equal([True, False, False, False], keep)
+
+    def test_filter_ipus_default(self):
+
+        # Nothing is filtered out by default
+        keep = filter_ipus(self.data, self.sample_rate, self.ipu_df)
+
+        np.testing.assert_array_equal([True, True, True, True], keep)
+
+    def test_filter_ipus_logged(self):
+
+        with self.assertLogs("autoannot.transcription.filter_ipus", level="INFO") as logs:
+            filter_ipus(self.data, self.sample_rate, self.ipu_df, min_rms=0.001)
+
+        self.assertIn("2 of 4 IPUs skipped", logs.output[0])
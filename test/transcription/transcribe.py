@@ -2,13 +2,15 @@ import json
 from pathlib import Path
 import tempfile
 import unittest
+from unittest import mock
 
 import pandas as pd
 
 from autoannot import ROOT_DIR
-from autoannot.transcription.transcribe import transcribe
+from autoannot.transcription.transcribe import transcribe, transcribe_corpus
 
 TEST_WAV_FILE = ROOT_DIR / "data" / "test" / "wav_dir" / "AB-buzz.wav"
+TEST_DIA_FILE = ROOT_DIR / "data" / "test" / "dst_dir" / "diarizations" / "AB-buzz.csv"
 TEST_PARAMETERS_FILE = ROOT_DIR / "data" / "parameters.json"
 
 
@@ -29,3 +31,51 @@ class Transcribe(unittest.TestCase):
 
         df = pd.read_csv(out_file)
         self.temp_dir.cleanup()
+
+    def test_transcription_corpus(self):
+
+        self.params["transcription"]["backend"] = "wav2vec2"
+
+        out_file = self.temp_dir_name / "transcription.csv"
+        out_files = [self.temp_dir_name / "transcription_1.csv", self.temp_dir_name / "transcription_2.csv"]
+
+        transcribe(TEST_WAV_FILE, out_file, TEST_DIA_FILE, self.params)
+        transcribe_corpus([TEST_WAV_FILE, TEST_WAV_FILE], out_files, [TEST_DIA_FILE, TEST_DIA_FILE], self.params)
+
+        # Same layout and transcriptions as one file at a time
+        df = pd.read_csv(out_file)
+        for corpus_out_file in out_files:
+            pd.testing.assert_frame_equal(df, pd.read_csv(corpus_out_file))
+
+        self.temp_dir.cleanup()
+
+
+class TranscribeCorpus(unittest.TestCase):
+
+    def test_transcription_corpus_errors(self):
+
+        params = {"transcription": {"backend": "wav2vec2", "wav2vec2": {}, "empty": "noise"}}
+        module = "autoannot.transcription.transcribe"
+
+        def transcribe_file(in_file, out_file, dia_file, params):
+            if in_file == "b.wav":
+                raise RuntimeError("b.wav")
+
+        def transcribe_group(in_files, dia_files, **kwargs):
+            if "b.wav" in in_files:
+                raise RuntimeError("group")
+            return [pd.DataFrame() for _ in in_files]
+
+        with mock.patch(f"{module}.group_files", return_value=[[0, 1], [2]]), \
+                mock.patch(f"{module}.transcribe_wav2vec2_corpus", side_effect=transcribe_group) as corpus, \
+                mock.patch(f"{module}.transcribe", side_effect=transcribe_file) as single, \
+                mock.patch(f"{module}.clean_transcription", side_effect=lambda df, empty: df), \
+                mock.patch.object(pd.DataFrame, "to_csv"):
+            errors = transcribe_corpus(["a.wav", "b.wav", "c.wav"], ["a.csv", "b.csv", "c.csv"],
+                                       ["a_dia.csv", "b_dia.csv", "c_dia.csv"], params)
+
+        # Only the files of the failed group are transcribed again, both failures are recorded
+        self.assertEqual(2, corpus.call_count)
+        self.assertEqual(["a.wav", "b.wav"], [c.args[0] for c in single.call_args_list])
+        self.assertEqual(["a.wav, b.wav", "b.wav"], errors["file"])
+        self.assertIn("RuntimeError: group", errors["error"][0])
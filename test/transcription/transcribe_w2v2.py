@@ -0,0 +1,62 @@
+from pathlib import Path
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from autoannot.transcription.transcribe_w2v2 import SR_RATE, _get_batches, group_files
+
+
+class GetBatches(unittest.TestCase):
+
+    def test_get_batches(self):
+
+        lengths = np.array([100, 400, 50, 300, 1000, 100])
+        order = list(np.argsort(-lengths, kind="stable"))
+
+        batches = _get_batches(order, lengths, max_batch_samples=900)
+
+        # Longer than the budget alone, then padded sizes 2 x 400 and 3 x 100 (+ 1 x 50)
+        self.assertEqual([[4], [1, 3], [0, 5, 2]], batches)
+        self.assertEqual(sorted(order), sorted(i for batch in batches for i in batch))
+
+    def test_get_batches_no_budget(self):
+
+        lengths = np.array([10, 10, 10])
+
+        self.assertEqual([[0], [1], [2]], _get_batches([0, 1, 2], lengths, max_batch_samples=0))
+
+
+class GroupFiles(unittest.TestCase):
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dia_files = []
+
+        # 2 s, 5 s, 1 s and 1 s of IPUs, each followed by 1 s of silence
+        for i, durations in enumerate([[1.0, 1.0], [5.0], [0.5, 0.5], [1.0]]):
+            boundaries = np.cumsum([0.0] + [d for duration in durations for d in (duration, 1.0)])
+            df = pd.DataFrame({"tier": "IPUs", "start": boundaries[:-1], "end": boundaries[1:],
+                               "annotation": ["ipu", "#"] * len(durations)})
+
+            self.dia_files.append(Path(self.temp_dir.name) / f"{i}.csv")
+            df.to_csv(self.dia_files[-1], index=False)
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def test_group_files(self):
+
+        # Longer than the budget alone, the others as long as they fit
+        self.assertEqual([[0], [1], [2, 3]], group_files(self.dia_files, max_corpus_samples=3 * SR_RATE))
+        self.assertEqual([[0, 1, 2, 3]], group_files(self.dia_files))
+
+    def test_group_files_missing(self):
+
+        # A diarization that cannot be read is alone in its group
+        dia_files = self.dia_files[:2] + [Path(self.temp_dir.name) / "missing.csv"] + self.dia_files[2:]
+
+        self.assertEqual([[0, 1], [2], [3, 4]], group_files(dia_files))
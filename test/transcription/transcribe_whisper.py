@@ -2,11 +2,15 @@ import json
 from pathlib import Path
 import tempfile
 import unittest
+from unittest import mock
 
+import numpy as np
 import pandas as pd
+from scipy.io import wavfile
 
 from autoannot import ROOT_DIR
-from autoannot.transcription.transcribe_whisper import transcribe_whisper
+from autoannot.transcription.transcribe_whisper import transcribe_whisper, _convert_to_dataframe, _get_words
+from autoannot.transcription.transcribe_whisper import _make_cropped, _pack_ipus, _read_files
 
 TEST_WAV_FILE = ROOT_DIR / "data" / "test" / "wav_dir" / "AB-buzz.wav"
 TEST_PARAMETERS_FILE = ROOT_DIR / "data" / "parameters.json"
@@ -30,3 +34,149 @@ class TranscribeWhisper(unittest.TestCase):
         df = pd.read_csv(out_file)
 
         self.temp_dir.cleanup()
+
+
+class MakeCropped(unittest.TestCase):
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_name = Path(self.temp_dir.name)
+
+        # Stereo 44.1 kHz file with two IPUs
+        self.wav_file = self.temp_dir_name / "audio.wav"
+        wavfile.write(self.wav_file, 44_100, np.zeros((3 * 44_100, 2), dtype=np.int16))
+
+        self.dia_file = self.temp_dir_name / "diarization.csv"
+        pd.DataFrame({"tier": "IPUs", "start": [0.0, 0.5, 1.0, 2.0], "end": [0.5, 1.0, 2.0, 3.0],
+                      "annotation": ["#", "ipu", "#", "ipu"]}).to_csv(self.dia_file, index=False)
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def test_make_cropped(self):
+
+        data, sample_rate, dia_df = _read_files(self.wav_file, self.dia_file)
+        windows, ipu_df = _make_cropped(data, sample_rate, dia_df[dia_df["annotation"] == "ipu"])
+
+        # Mono 16 kHz float32 array, nothing written to disk
+        self.assertEqual(1, len(windows))
+        self.assertEqual(np.float32, windows[0].dtype)
+        self.assertEqual((int(1.5 * 16_000),), windows[0].shape)
+        self.assertEqual(["audio.wav", "diarization.csv"], sorted(p.name for p in self.temp_dir_name.iterdir()))
+
+        np.testing.assert_allclose([0.0, 0.5], ipu_df["start"])
+        np.testing.assert_allclose([0.5, 1.5], ipu_df["end"])
+        self.assertEqual([1, 3], list(ipu_df["index"]))
+
+    def test_make_cropped_windows(self):
+
+        data, sample_rate, dia_df = _read_files(self.wav_file, self.dia_file)
+        ipu_rows = dia_df[dia_df["annotation"] == "ipu"]
+
+        # Each IPU in its own window
+        windows, ipu_df = _make_cropped(data, sample_rate, ipu_rows, window_duration=1.2, separator=0.5)
+
+        self.assertEqual([int(0.5 * 16_000), 16_000], [len(window) for window in windows])
+        self.assertEqual([0, 1], list(ipu_df["window"]))
+        np.testing.assert_allclose([0.0, 0.0], ipu_df["start"])
+
+        # Both IPUs in the same window, separated by a silence
+        windows, ipu_df = _make_cropped(data, sample_rate, ipu_rows, window_duration=2.0, separator=0.5)
+
+        self.assertEqual([int(2.0 * 16_000)], [len(window) for window in windows])
+        np.testing.assert_allclose([0.0, 1.0], ipu_df["start"])
+        np.testing.assert_allclose([0.5, 2.0], ipu_df["end"])
+
+
+class PackIPUs(unittest.TestCase):
+
+    def test_pack_ipus(self):
+
+        durations = np.array([10.0, 10.0, 9.0, 35.0, 5.0, 5.0])
+
+        # 10 + 1 + 10 + 1 + 9 > 30, an IPU longer than the window is alone
+        np.testing.assert_array_equal([0, 0, 1, 2, 3, 3], _pack_ipus(durations, 30.0, 1.0))
+        np.testing.assert_array_equal([0, 0, 0, 1, 2, 2], _pack_ipus(durations, 30.0, 0.5))
+
+
+class ConvertToDataFrame(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dia_df = pd.DataFrame({"tier": "IPUs", "start": [0.0, 0.5, 1.0, 2.0, 2.5], "end": [0.5, 1.0, 2.0, 2.5, 3.0],
+                                    "annotation": ["#", "ipu", "#", "ipu", "ipu"]})
+        self.ipu_df = pd.DataFrame({"start": [0.0, 0.5, 1.0], "end": [0.5, 1.0, 1.5], "index": [1, 3, 4],
+                                    "window": 0})
+
+    def test_convert_to_dataframe(self):
+
+        words = [{"text": "a", "start": 0.0, "end": 0.2},
+                 {"text": "b", "start": 0.2, "end": 0.5},  # ends on the boundary: first IPU
+                 {"text": "c", "start": 0.5, "end": 0.6},  # starts on the boundary: second IPU
+                 {"text": "d", "start": 0.9, "end": 1.1},  # across two IPUs: ignored
+                 {"text": "e", "start": 1.2, "end": 2.0}]  # ends beyond the last IPU: last IPU
+        transcription = {"segments": [{"words": words[:2]}, {"words": words[2:]}]}
+
+        df = _convert_to_dataframe(_get_words([transcription], self.ipu_df), self.dia_df)
+
+        self.assertEqual(["#", "a b", "#", "c", "e"], list(df["annotation"]))
+        pd.testing.assert_series_equal(self.dia_df["end"], df["end"])
+
+    def test_convert_to_dataframe_windows(self):
+
+        # Last IPU in a second window, after a silence
+        ipu_df = pd.DataFrame({"start": [0.0, 1.0, 0.0], "end": [0.5, 1.5, 0.5], "index": [1, 3, 4], "window": [0, 0, 1]})
+
+        transcription_1 = {"segments": [{"words": [{"text": "a", "start": 0.1, "end": 0.6},  # ends in the silence
+                                                   {"text": "b", "start": 0.6, "end": 0.8},  # in the silence: ignored
+                                                   {"text": "c", "start": 0.9, "end": 1.4}]}]}
+        transcription_2 = {"segments": [{"words": [{"text": "d", "start": 0.0, "end": 0.5}]}]}
+
+        df = _convert_to_dataframe(_get_words([transcription_1, transcription_2], ipu_df), self.dia_df)
+
+        self.assertEqual(["#", "a", "#", "c", "d"], list(df["annotation"]))
+
+    def test_convert_to_dataframe_empty(self):
+
+        df = _convert_to_dataframe(_get_words([{"segments": []}], self.ipu_df), self.dia_df)
+
+        self.assertEqual(["#", "", "#", "", ""], list(df["annotation"]))
+
+
+class Cascade(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dia_df = pd.DataFrame({"tier": "IPUs", "start": [0.0, 1.0, 2.0], "end": [1.0, 2.0, 3.0],
+                                    "annotation": ["ipu", "#", "ipu"]})
+        self.data = np.zeros(3 * 16_000, dtype=np.float32)
+
+    @staticmethod
+    def _transcribe(model, device, windows, condition_on_previous_text):
+        """Small model is confident on the first IPU only, the large model transcribes the second one"""
+
+        if model == "large":
+            return [{"segments": [{"avg_logprob": -0.1, "no_speech_prob": 0.0,
+                                   "words": [{"text": "large", "start": 0.0, "end": 0.5}]}]}]
+
+        return [{"segments": [{"avg_logprob": -0.1, "no_speech_prob": 0.0,
+                               "words": [{"text": "small", "start": 0.0, "end": 0.5}]},
+                              {"avg_logprob": -2.0, "no_speech_prob": 0.0,
+                               "words": [{"text": "small", "start": 1.0, "end": 1.5}]}]}]
+
+    def test_cascade(self):
+
+        module = "autoannot.transcription.transcribe_whisper"
+        with mock.patch(f"{module}._read_files", return_value=(self.data, 16_000, self.dia_df)), \
+                mock.patch(f"{module}._transcribe", side_effect=self._transcribe) as transcribe:
+
+            df = transcribe_whisper("audio.wav", "diarization.csv", model="tiny", use_cuda=False,
+                                    cascade_model="large")
+
+        self.assertEqual(["small", "#", "large"], list(df["annotation"]))
+        self.assertEqual(["tiny", "large"], [call.args[0] for call in transcribe.call_args_list])
+
+        # Only the second IPU is decoded again
+        self.assertEqual(16_000, len(transcribe.call_args_list[1].args[2][0]))
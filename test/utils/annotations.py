@@ -6,7 +6,7 @@ import unittest
 import pandas as pd
 
 from autoannot import ROOT_DIR
-from autoannot.utils.annotations import fill_missing
+from autoannot.utils.annotations import fill_missing, merge_rows
 
 TEST_WAV_FILE = ROOT_DIR / "data" / "test" / "wav_dir" / "AB-buzz.wav"
 TEST_PARAMETERS_FILE = ROOT_DIR / "data" / "parameters.json"
@@ -29,3 +29,82 @@ class FillMissing(unittest.TestCase):
 
         df = fill_missing(self.df, target=None, fill_symbol="#")
         print(df)
+
+    def test_fill_missing(self):
+
+        df = fill_missing(self.df, target=None, fill_symbol="#")
+
+        self.assertEqual(["test", "#", "test", "#", "test"], df["annotation"].to_list())
+        self.assertEqual([0.0, 0.5, 1.0, 1.5, 2.0], df["start"].to_list())
+        self.assertEqual([0.5, 1.0, 1.5, 2.0, 2.5], df["end"].to_list())
+
+    def test_fill_missing_target(self):
+
+        df = self.df.copy()
+        df.loc[1, "annotation"] = "skip"
+
+        df = fill_missing(df, target="skip", fill_symbol="#", min_duration=0.0)
+
+        self.assertEqual(["test", "#", "test"], df["annotation"].to_list())
+        self.assertEqual([0.0, 0.5, 2.0], df["start"].to_list())
+        self.assertEqual([0.5, 2.0, 2.5], df["end"].to_list())
+
+    def test_fill_missing_min_duration(self):
+
+        df = fill_missing(self.df, target=None, fill_symbol="#", min_duration=0.5)
+
+        self.assertEqual(["test", "test", "test"], df["annotation"].to_list())
+
+
+class MergeRows(unittest.TestCase):
+
+    def setUp(self):
+
+        df = {"tier": ["test"] * 5,
+              "start": [0.0, 1.0, 2.0, 3.0, 4.0],
+              "end": [1.0, 2.0, 3.0, 4.0, 5.0],
+              "annotation": ["#", "#", "ipu", "ipu", "ipu"]}
+
+        self.df = pd.DataFrame(df)
+
+    def test_merge_rows(self):
+
+        df = merge_rows(self.df)
+
+        self.assertEqual(["#", "ipu"], df["annotation"].to_list())
+        self.assertEqual([0.0, 2.0], df["start"].to_list())
+        self.assertEqual([2.0, 5.0], df["end"].to_list())
+
+    def test_merge_rows_target(self):
+
+        df = merge_rows(self.df, target="#")
+
+        self.assertEqual(["#", "ipu", "ipu", "ipu"], df["annotation"].to_list())
+        self.assertEqual([0.0, 2.0, 3.0, 4.0], df["start"].to_list())
+        self.assertEqual([2.0, 3.0, 4.0, 5.0], df["end"].to_list())
+
+    def test_merge_rows_target_gap(self):
+
+        df = pd.DataFrame({"tier": ["test"] * 5,
+                           "start": [0.0, 1.0, 2.0, 3.5, 4.0],
+                           "end": [1.0, 1.5, 3.0, 4.0, 5.0],
+                           "annotation": ["#", "#", "ipu", "ipu", "#"]})
+
+        df = merge_rows(df, target="#")
+
+        # Each row ends where it did, gaps are not absorbed
+        self.assertEqual(["#", "ipu", "ipu", "#"], df["annotation"].to_list())
+        self.assertEqual([0.0, 2.0, 3.5, 4.0], df["start"].to_list())
+        self.assertEqual([1.5, 3.0, 4.0, 5.0], df["end"].to_list())
+
+    def test_merge_rows_empty(self):
+
+        self.assertEqual(0, len(merge_rows(self.df.iloc[:0])))
+
+    def test_merge_rows_single(self):
+
+        df = merge_rows(self.df.iloc[:1])
+
+        self.assertEqual(["#"], df["annotation"].to_list())
+        self.assertEqual([0.0], df["start"].to_list())
+        self.assertEqual([1.0], df["end"].to_list())
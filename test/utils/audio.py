@@ -0,0 +1,73 @@
+from pathlib import Path
+import tempfile
+import unittest
+
+import numpy as np
+from scipy.io import wavfile
+
+from autoannot.utils.audio import get_file_hash, get_segment, load_audio, open_audio, set_audio_cache
+
+
+class AudioCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_name = Path(self.temp_dir.name)
+        self.cache_dir = self.temp_dir_name / "cache"
+
+        # Stereo 16-bit file
+        self.wav_file = self.temp_dir_name / "audio.wav"
+        rng = np.random.default_rng(0)
+        wavfile.write(self.wav_file, 32_000, rng.integers(-2 ** 14, 2 ** 14, (32_000, 2), dtype=np.int16))
+
+    def tearDown(self):
+
+        set_audio_cache(None)
+        self.temp_dir.cleanup()
+
+    def test_load_audio(self):
+
+        set_audio_cache(self.cache_dir)
+
+        data, sample_rate = load_audio(self.wav_file)
+        resampled_data, resampled_rate = load_audio(self.wav_file, 16_000)
+
+        # Mono float32, one sidecar per sample rate
+        self.assertEqual((32_000, 16_000), (sample_rate, resampled_rate))
+        self.assertEqual(((32_000,), (16_000,)), (data.shape, resampled_data.shape))
+        self.assertEqual(np.float32, data.dtype)
+        self.assertIsInstance(data, np.memmap)
+        self.assertEqual(2, len(list(self.cache_dir.glob("*.npy"))))
+
+        # Same as decoding without the cache
+        set_audio_cache(None)
+        np.testing.assert_allclose(load_audio(self.wav_file)[0], data)
+
+    def test_load_audio_budget(self):
+
+        other_file = self.temp_dir_name / "other.wav"
+        wavfile.write(other_file, 32_000, np.zeros(32_000, dtype=np.int16))
+
+        # Room for a single file: the least recently used one is removed
+        set_audio_cache(self.cache_dir, disk_budget=32_000 * 4 + 1_000)
+
+        load_audio(self.wav_file)
+        load_audio(other_file)
+
+        self.assertEqual([f"{get_file_hash(other_file)}_32000.npy"], [p.name for p in self.cache_dir.glob("*.npy")])
+
+    def test_get_segment(self):
+
+        # Memory-mapped as it is
+        data, sample_rate = open_audio(self.wav_file)
+        self.assertEqual((32_000, (32_000, 2), np.int16), (sample_rate, data.shape, data.dtype))
+        self.assertIsInstance(data, np.memmap)
+
+        # Mono float32, same as decoding the whole file
+        segment = get_segment(data, sample_rate, 0.25, 0.5)
+        self.assertEqual(((8_000,), np.float32), (segment.shape, segment.dtype))
+        np.testing.assert_allclose(load_audio(self.wav_file)[0][8_000:16_000], segment, atol=1e-6)
+
+        # Resampled
+        self.assertEqual((4_000,), get_segment(data, sample_rate, 0.25, 0.5, 16_000).shape)
@@ -0,0 +1,93 @@
+import unittest
+
+from autoannot.utils.models import get_model, evict_model, clear_models, set_memory_budget
+
+
+class FakeTensor:
+
+    def __init__(self, n_bytes):
+        self.n_bytes = n_bytes
+
+    def numel(self):
+        return self.n_bytes
+
+    def element_size(self):
+        return 1
+
+
+class FakeModel:
+
+    def __init__(self, n_bytes):
+        self.tensor = FakeTensor(n_bytes)
+
+    def parameters(self):
+        return [self.tensor]
+
+    def buffers(self):
+        return []
+
+
+class ModelRegistry(unittest.TestCase):
+
+    def setUp(self):
+
+        clear_models()
+        set_memory_budget(None)
+        self.n_loads = 0
+
+    def tearDown(self):
+
+        clear_models()
+        set_memory_budget(None)
+
+    def _loader(self, n_bytes=10):
+
+        def _load():
+            self.n_loads += 1
+            return FakeModel(n_bytes)
+
+        return _load
+
+    def test_warm_reuse(self):
+
+        model = get_model("whisper", "tiny", "cpu", loader=self._loader())
+        same_model = get_model("whisper", "tiny", "cpu", loader=self._loader())
+
+        self.assertIs(model, same_model)
+        self.assertEqual(1, self.n_loads)
+
+        # Any difference in the key loads a new model
+        get_model("whisper", "tiny", "cuda", loader=self._loader())
+        get_model("wav2vec2", "tiny", "cpu", loader=self._loader(), adapter="fra")
+        self.assertEqual(3, self.n_loads)
+
+    def test_evict(self):
+
+        get_model("whisper", "tiny", "cpu", loader=self._loader())
+
+        self.assertTrue(evict_model("whisper", "tiny", "cpu"))
+        self.assertFalse(evict_model("whisper", "tiny", "cpu"))
+
+        get_model("whisper", "tiny", "cpu", loader=self._loader())
+        self.assertEqual(2, self.n_loads)
+
+    def test_memory_budget(self):
+
+        set_memory_budget(25)
+
+        get_model("whisper", "a", "cpu", loader=self._loader(10))
+        get_model("whisper", "b", "cpu", loader=self._loader(10))
+        get_model("whisper", "a", "cpu", loader=self._loader(10))  # "b" is now the least recently used
+        get_model("whisper", "c", "cpu", loader=self._loader(10))
+        self.assertEqual(3, self.n_loads)
+
+        get_model("whisper", "a", "cpu", loader=self._loader(10))
+        self.assertEqual(3, self.n_loads)
+
+        get_model("whisper", "b", "cpu", loader=self._loader(10))
+        self.assertEqual(4, self.n_loads)
+
+    def test_none_not_kept(self):
+
+        self.assertIsNone(get_model("pyannote", "model", "cpu", loader=lambda: None))
+        self.assertFalse(evict_model("pyannote", "model", "cpu"))